@@ -3,15 +3,25 @@
 import argparse
 import logging
 import os
+import time
 
 #from clients.garminclient import GarminClient
-from clients.garminapi import Garmin
-from clients.icalclient import ICalClient
 
-from models.workout import Workout
-from models.schedule import Schedule
+# The commands import what they need themselves. garth, requests and pydantic take
+# half a second to import, dry only needs the workout model (see tools/bench_import.py)
+
+# Every garmin request of this run is recorded here, created by _metrics on first use
+_METRICS = None
+
+# The recorded or replayed http session of this run, see --record and --replay
+_CASSETTE = None
+
+# Names of Garmin.ActivityDownloadFormat, listed here to keep the garmin client out of the argument parsing
+_DOWNLOAD_FORMATS = ("ORIGINAL", "TCX", "GPX", "KML", "CSV")
 
 def command_dry(args):
+    from models.workout import Workout
+
     filename = "test_workouts/" + args.name + ".txt"
     # Read the contents of the test file
     if not os.path.isfile(filename):
@@ -22,84 +32,450 @@ def command_dry(args):
         w = Workout("test_workout", f.read())
         # print the json
         #w.create_workout()
-        Workout.print_workout_json(w.create_workout())
+        payload = w.create_workout()
+        Workout.print_workout_json(payload, args.compact)
+        logging.info("Workout hash %s", Workout.workout_hash(payload))
+
+def command_fit(args):
+    from clients.icalclient import ICalClient
+    from models.fit import FitWorkoutEncoder
+    from models.workout import Workout
+
+    logging.info("Writing FIT workouts from google calendar")
+
+    if not os.path.isdir(args.output):
+        logging.error("Output directory '%s' does not exist" % args.output)
+        return
+
+    encoder = FitWorkoutEncoder()
+    with _transport(args) as transport:
+        cal_events = ICalClient.get_events(args.id, args.name, args.ical_url, transport)
+
+    for cal_item in cal_events:
+        w = Workout(cal_item.title, cal_item.description)
+        filename = encoder.write(w, args.output, "%s %s" % (cal_item.get_dt_start(), w.get_workout_name()))
+        logging.info("Workout '%s' on '%s' written to '%s'" % (w.get_workout_name(), cal_item.get_dt_start(), filename))
 
 def command_sync(args):
+    from clients.icalclient import ICalClient
+    from clients.metrics import PhaseTimer
+
     logging.info("Syncing from google calendar")
+    timer = PhaseTimer(_metrics())
 
-    # Read calendar items for next 5 days
-    cal_events = ICalClient.get_events(args.id, args.name)
-    
-    # Compare to online garmin workouts
-    #with _garmin_client(args) as connection:
-    connection = Garmin(email=args.username, password=args.password, is_cn=False, prompt_mfa=None)
-    connection.login()
+    # One connection pool for google calendar and garmin
+    transport = _transport(args, args.workers)
+    try:
+        # Read calendar items for next 5 days
+        with timer.phase("ics_fetch"):
+            url_get = ICalClient.fetch(args.id, args.name, args.ical_url, transport)
+        with timer.phase("ics_parse"):
+            cal_events = ICalClient().string_to_container(url_get.text)
+        timer.count("events", len(cal_events))
+
+        # Compare to online garmin workouts
+        #with _garmin_client(args) as connection:
+        with timer.phase("login"):
+            connection = _garmin_connection(args, transport)
+
+        _sync(connection, cal_events, args, timer)
+    finally:
+        transport.close()
 
-    # First we sync the workouts
-    sync_workouts = {}
-    existing_workouts_by_name = { Workout.extract_workout_name(w): w for w in connection.get_workouts() }
+    logging.info("Sync timings %s" % timer.to_json())
+    if args.timings is not None:
+        with open(args.timings, "w") as f:
+            f.write(timer.to_json(indent=2))
 
+def _sync(connection, cal_events, args, timer=None):
+    """Bring garmin in line with the calendar items, returns False when the sync failed"""
+    from clients.icalclient import CalendarItem
+    from clients.metrics import PhaseTimer
+    from models.plan import SyncPlan
+    from models.schedule import Schedule
+    from models.workout import Workout
+
+    timer = timer or PhaseTimer()
+    journal = _sync_journal(args)
     try:
-        today = ICalClient.get_today()
-        existing_scheduled_workouts = {s.extract_item_workout(): s.extract_item_date() for s in Schedule.items(connection.get_schedule(today.year, today.month))}
-        
-        # Loop ics calendar items
-        for cal_item in cal_events:
-            w = Workout(cal_item.title, cal_item.description)
-
-            workout_name = "T | %s - %s" % (w.get_workout_name(), cal_item.uid)
-            local_workout = existing_workouts_by_name.get(workout_name)
-
-            create_workout = True
-            if local_workout:
-                wid = Workout.extract_workout_id(local_workout)
-
-                wid_exists = wid in existing_scheduled_workouts
-                wid_is_updated = cal_item.is_changed()
-                wid_is_new_date = wid_exists and existing_scheduled_workouts[wid] != cal_item.get_dt_start()
-                if (not wid_exists or wid_is_updated or wid_is_new_date):
-                    if (not wid_exists):
-                        logging.info("The workout '%s' on '%s' does not exist in the current scheduled workout list" % (workout_name, cal_item.get_dt_start()))
-                    elif (wid_is_updated):
-                        logging.info("The workout '%s' on '%s' was updated since last run" % (workout_name, cal_item.get_dt_start()))
-                    else:
-                        logging.info("The workout '%s' on '%s' (old: '%s') was updated with a new date" % (workout_name, cal_item.get_dt_start(), existing_scheduled_workouts[wid]))
-                    # Remove the workout on the garmin client. This way it is also removed from the schedule
-                    logging.info("Deleting workout '%s' on '%s'" % (workout_name, existing_scheduled_workouts[wid]))
-                    connection.delete_workout(wid)
-                else:
-                    create_workout = False
-                    logging.info("Workout exists and is in sync '%s' on '%s'" % (workout_name,cal_item.get_dt_start()))
-            
-            if create_workout:
+        # Every month the synced window touches, a workout can be scheduled on several dates
+        window_start, window_end = CalendarItem.window()
+        months = Schedule.months(window_start, window_end)
+        with timer.phase("listing"):
+            schedule = Schedule(connection.get_schedule(year, month) for year, month in months)
+            workouts = list(connection.get_workouts())
+        timer.count("workouts", len(workouts))
+
+        if journal is not None and journal.pending():
+            # Finish what an interrupted sync started, then look again at what is on garmin now
+            with timer.phase("replay"):
+                timer.count("replayed", len(journal.pending()))
+                _replay_journal(connection, journal, workouts, schedule)
+            with timer.phase("listing"):
+                schedule = Schedule(connection.get_schedule(year, month) for year, month in months)
+                workouts = list(connection.get_workouts())
+
+        # Join the calendar events and the synced workouts on their identity marker
+        with timer.phase("plan"):
+            plan = SyncPlan.build(cal_events, workouts, schedule)
+        logging.info("Sync plan: %s" % plan.summary())
+        for name, changes in (("creates", plan.creates), ("updates", plan.updates), ("schedules", plan.schedules),
+                              ("unschedules", plan.unschedules), ("deletes", plan.deletes), ("unchanged", plan.unchanged)):
+            timer.count(name, len(changes))
+
+        for workout_id, day in plan.unchanged:
+            logging.info("Workout %s exists and is in sync on '%s'" % (workout_id, day))
+
+        with timer.phase("writes"):
+            for workout_id, payload in plan.updates:
+                logging.info("Updating workout '%s' (hash %s)" % (Workout.extract_workout_name(payload), Workout.extract_marker(payload)[1]))
+                _journaled(journal, lambda: connection.update_workout(workout_id, payload), "update", workout_id=workout_id, workout=payload)
+
+            for workout_id, schedule_id, day in plan.unschedules:
+                logging.info("Workout %s is not on '%s' anymore" % (workout_id, day))
+                _journaled(journal, lambda: connection.unschedule_workout(schedule_id), "unschedule", schedule_id=schedule_id)
+
+            sync_workouts = list(plan.schedules)
+            for key, payload, day in plan.creates:
                 # Create the workout in the garmin site
-                payload = w.create_workout(workout_name)
-                logging.info("Creating workout '%s'", workout_name)
-                created_workout_json = connection.upload_workout(payload)
-                existing_workouts_by_name[workout_name] = created_workout_json
-                sync_workouts[Workout.extract_workout_id(created_workout_json)] = cal_item.get_dt_start()
-
-            # Update the workout as found
-            existing_workouts_by_name[workout_name]["is_calendar_workout"] = True
-
-        # Delete rest if not found. Only if name starts with T|
-        for w in existing_workouts_by_name:
-            if "is_calendar_workout" not in existing_workouts_by_name[w]:
-                if w[:3] == "T |":
-                    # Delete this workout because it is not relevant anymore
-                    connection.delete_workout(Workout.extract_workout_id(existing_workouts_by_name[w]))
-                    logging.info("Removing workout '%s', because date did not fit time window" % w)
-
-        # Schedule the items on the garmin calendar
-        for workout_id in sync_workouts:
-            date_workout = sync_workouts[workout_id]
-            connection.schedule_workout(workout_id, date_workout)
-            logging.info("Workout %s was scheduled on '%s'" % (workout_id, date_workout))
+                logging.info("Creating workout '%s' (hash %s)" % (Workout.extract_workout_name(payload), Workout.extract_marker(payload)[1]))
+                workout_id = _journaled(journal, lambda: Workout.extract_workout_id(connection.upload_workout(payload)), "create", keep_result=True, key=key, workout=payload, date=day)
+                sync_workouts.append((workout_id, day))
+
+            # Schedule the items on the garmin calendar
+            for workout_id, date_workout in sync_workouts:
+                _journaled(journal, lambda: connection.schedule_workout(workout_id, date_workout), "schedule", workout_id=workout_id, date=date_workout)
+                logging.info("Workout %s was scheduled on '%s'" % (workout_id, date_workout))
+
+        # The workouts of events that left the window, in a stage of their own so one failure does not stop the rest
+        with timer.phase("cleanup"):
+            _cleanup_orphans(connection, plan.deletes, args.max_deletes, args.workers, journal)
+        return True
 
     except Exception as err:
-        err.message
-        logging.error(err)
-        
+        logging.error("Sync failed: %s" % err)
+        return False
+
+    finally:
+        if journal is not None:
+            journal.compact()
+            journal.close()
+
+def command_watch(args):
+    import random
+    import signal
+    import threading
+
+    from clients.cache import ResponseCache
+    from clients.health import HealthServer, WatchStatus
+    from clients.icalclient import CalendarFeed
+    from clients.webhook import SyncTrigger
+
+    # Arguments are checked before the login and the first poll
+    if len(args.id) != len(args.name):
+        logging.error("Give a --name for every --id")
+        return
+    if args.webhook and args.port is None:
+        logging.error("The webhook needs a --port")
+        return
+    if args.webhook and not args.webhook_token:
+        # Anyone reaching the port could otherwise make it sync
+        logging.error("The webhook needs a --webhook-token")
+        return
+
+    # Logged in once, the session, the parsed calendars and the garmin responses stay in memory
+    transport = _transport(args, args.workers)
+    connection = _garmin_connection(args, transport)
+    if connection.cache is None:
+        connection.cache = ResponseCache(":memory:")
+    feeds = [CalendarFeed(calendar_id, name, args.ical_url, transport) for calendar_id, name in zip(args.id, args.name)]
+
+    status = WatchStatus(args.interval)
+    trigger = SyncTrigger(args.debounce) if args.webhook else None
+    server = None
+    if args.port is not None:
+        server = HealthServer((args.bind, args.port), status, _metrics(), trigger, args.id, args.webhook_token)
+        server.start()
+
+    stop = threading.Event()
+    def request_stop(signum, frame):
+        logging.info("Received signal %d, stopping after the current sync" % signum)
+        stop.set()
+        if trigger is not None:
+            trigger.close()
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+
+    logging.info("Watching %d calendars every %d seconds" % (len(feeds), args.interval))
+    polls = 0
+    pushed = []
+    try:
+        while not stop.is_set():
+            try:
+                if pushed:
+                    # Only the calendars of the notifications, the others keep their parsed events
+                    changed = [feed.poll() for feed in feeds if feed.calendar_id in pushed]
+                    full = False
+                else:
+                    # Every feed is polled, a conditional request costs next to nothing when nothing changed
+                    changed = [feed.poll() for feed in feeds]
+                    # Once in a while also when nothing changed, to repair changes made on garmin itself
+                    full = args.full_every > 0 and polls % args.full_every == 0
+                    polls = polls + 1
+                status.polled()
+                if any(changed) or full:
+                    logging.info("Syncing, %s" % ("calendar changed" if any(changed) else "periodic full sync"))
+                    cal_events = [e for feed in feeds for e in feed.events]
+                    ok = _sync(connection, cal_events, args)
+                    status.synced(ok, None if ok else "Sync failed, see the log")
+                else:
+                    logging.debug("Calendars not modified")
+            except Exception as err:
+                logging.error("Watch poll failed: %s" % err)
+                status.synced(False, str(err))
+
+            # Jitter keeps many watchers from polling in lock step
+            wait = args.interval * random.uniform(1 - args.jitter, 1 + args.jitter)
+            if trigger is not None:
+                pushed = trigger.wait(wait)
+                if pushed:
+                    logging.info("Change notification for %s" % ", ".join(pushed))
+            else:
+                stop.wait(wait)
+    finally:
+        if server is not None:
+            server.stop()
+        transport.close()
+        logging.info("Watch stopped after %d polls" % polls)
+
+def _sync_journal(args):
+    if args.journal is None and args.cache_dir is None:
+        return None
+
+    from clients.journal import SyncJournal
+
+    return SyncJournal(args.journal or os.path.join(args.cache_dir, "sync.journal"))
+
+def _journaled(journal, send, op, keep_result=False, **op_args):
+    """
+    Send a change, written ahead to the journal when there is one. With 'keep_result' the journal
+    also keeps the result, like the id of a new workout, responses are not json and stay out.
+    """
+    if journal is None:
+        return send()
+    seq = journal.intend(op, **op_args)
+    result = send()
+    journal.done(seq, result if keep_result else None)
+    return result
+
+def _replay_journal(connection, journal, workouts, schedule):
+    from models.workout import Workout
+
+    pending = journal.pending()
+    logging.info("Replaying %d unfinished changes of the previous sync" % len(pending))
+
+    # A create, schedule or delete may have reached garmin before the sync died, those are not sent again
+    synced = {}
+    for w in workouts:
+        marker = Workout.extract_marker(w)
+        if marker is not None:
+            synced[marker[0]] = Workout.extract_workout_id(w)
+    workout_ids = set(Workout.extract_workout_id(w) for w in workouts)
+    schedule_ids = set(s.schedule_id for s in schedule)
+
+    for seq, op, op_args in pending:
+        try:
+            if op == "create":
+                workout_id = synced.get(op_args["key"])
+                if workout_id is None:
+                    workout_id = Workout.extract_workout_id(connection.upload_workout(op_args["workout"]))
+                journal.done(seq, workout_id)
+                if op_args["date"] not in schedule.dates(workout_id):
+                    _journaled(journal, lambda: connection.schedule_workout(workout_id, op_args["date"]), "schedule", workout_id=workout_id, date=op_args["date"])
+            elif op == "schedule":
+                if op_args["date"] not in schedule.dates(op_args["workout_id"]):
+                    connection.schedule_workout(op_args["workout_id"], op_args["date"])
+                journal.done(seq)
+            elif op == "update":
+                connection.update_workout(op_args["workout_id"], op_args["workout"])
+                journal.done(seq)
+            elif op == "unschedule":
+                if op_args["schedule_id"] in schedule_ids:
+                    connection.unschedule_workout(op_args["schedule_id"])
+                journal.done(seq)
+            elif op == "delete":
+                if op_args["workout_id"] in workout_ids:
+                    connection.delete_workout(op_args["workout_id"])
+                journal.done(seq)
+            logging.info("Replayed %s %s" % (op, ", ".join("%s=%s" % (k, v) for k, v in sorted(op_args.items()) if k != "workout")))
+        except Exception as err:
+            status = _rejected_status(err)
+            if status in (404, 410):
+                # Removed on garmin in the meantime, e.g. by the user, nothing is left to change
+                logging.info("Not replaying %s, the item is gone (%d)" % (op, status))
+                journal.done(seq)
+            elif status is not None:
+                logging.warning("Dropping %s from the journal, garmin rejected it with %d: %s" % (op, status, err))
+                journal.done(seq)
+            else:
+                # Throttled, a server or a connection error, stays in the journal for the next run
+                logging.error("Replaying %s failed: %s" % (op, err))
+
+def _rejected_status(err):
+    """Status of a request garmin rejected for good, a 4xx other than 429. None for the errors worth retrying"""
+    from garth.exc import GarthHTTPError
+
+    if not isinstance(err, GarthHTTPError) or err.error.response is None:
+        return None
+    status = err.error.response.status_code
+    return status if 400 <= status < 500 and status != 429 else None
+
+def _cleanup_orphans(connection, deletes, max_deletes, workers, journal=None):
+    if not deletes:
+        return
+    if max_deletes is not None and len(deletes) > max_deletes:
+        # Most likely an empty or broken calendar feed, not a real cleanup
+        logging.error("Not removing %d workouts, that is more than --max-deletes %d" % (len(deletes), max_deletes))
+        return
+
+    names = dict(deletes)
+    intents = {}
+    if journal is not None:
+        intents = { workout_id: journal.intend("delete", workout_id=workout_id) for workout_id in names }
+
+    failed = {}
+    for workout_id, err in connection.delete_workouts(names, workers):
+        if err is None:
+            if journal is not None:
+                journal.done(intents[workout_id])
+            # Deleting the workout also removes it from the schedule
+            logging.info("Removed workout '%s', because it is not in the calendar window anymore" % names[workout_id])
+        else:
+            failed[workout_id] = err
+            logging.error("Could not remove workout '%s': %s" % (names[workout_id], err))
+
+    logging.info("Cleanup done, %d workouts removed and %d failed" % (len(names) - len(failed), len(failed)))
+
+def command_export(args):
+    from clients.garminapi import Garmin
+
+    logging.info("Exporting activities from %s to %s into '%s'" % (args.start, args.end, args.output))
+
+    with _transport(args, args.workers) as transport:
+        connection = _garmin_connection(args, transport)
+        dl_fmt = Garmin.ActivityDownloadFormat[args.format]
+
+        downloaded = skipped = failed = 0
+        for activity_id, path, is_downloaded in connection.export_activities(args.start, args.end, args.output, dl_fmt, args.workers):
+            if isinstance(path, Exception):
+                # Logged by export_activities
+                failed = failed + 1
+            elif is_downloaded:
+                downloaded = downloaded + 1
+                logging.info("Activity %s downloaded to '%s'" % (activity_id, path))
+            else:
+                skipped = skipped + 1
+                logging.debug("Activity %s already present in '%s'" % (activity_id, path))
+
+    logging.info("Export done, %d downloaded, %d already present and %d failed" % (downloaded, skipped, failed))
+
+def command_upload(args):
+    from clients.garminapi import Garmin
+    from clients.ledger import UploadLedger
+
+    logging.info("Uploading activities from '%s'" % args.input)
+
+    if not os.path.isdir(args.input):
+        logging.error("Input directory '%s' does not exist" % args.input)
+        return
+
+    extensions = tuple("." + f.name.lower() for f in Garmin.ActivityUploadFormat)
+    paths = []
+    for root, dirs, files in os.walk(args.input):
+        paths.extend(os.path.join(root, f) for f in sorted(files) if f.lower().endswith(extensions))
+
+    with _transport(args, args.workers) as transport:
+        connection = _garmin_connection(args, transport)
+        ledger = UploadLedger(args.ledger or os.path.join(args.input, ".garmin_uploads.db"))
+
+        results = {}
+        start = time.perf_counter()
+        try:
+            for path, result in connection.upload_activities(paths, ledger, args.workers):
+                results[result] = results.get(result, 0) + 1
+                logging.info("Activity '%s' %s" % (path, result))
+        finally:
+            ledger.close()
+
+    seconds = time.perf_counter() - start
+    logging.info("Upload done, %d files in %.1f s (%.1f files/s): %s" % (len(paths), seconds, len(paths) / seconds if seconds > 0 else 0,
+                 ", ".join("%d %s" % (n, r) for r, n in sorted(results.items()))))
+
+def command_archive(args):
+    from clients.archive import ActivityArchive
+
+    archive = ActivityArchive(args.db)
+    try:
+        if not args.offline:
+            with _transport(args, args.workers) as transport:
+                connection = _garmin_connection(args, transport)
+                new_ids = archive.refresh(connection, start=args.since, splits=args.splits, details=args.details, workers=args.workers)
+            logging.info("Archive refreshed, %d new activities, %d in total up to %s" % (len(new_ids), len(archive), archive.high_water_mark()))
+
+        if args.start or args.end or args.type:
+            for activity in archive.query(args.start, args.end, args.type):
+                print("%s\t%s\t%s\t%s\t%.0f" % (activity["activityId"], activity.get("startTimeLocal"), (activity.get("activityType") or {}).get("typeKey"),
+                      activity.get("activityName"), activity.get("distance") or 0))
+    finally:
+        archive.close()
+
+def _garmin_connection(args, transport=None):
+    from clients.garminapi import Garmin
+    from clients.ratelimit import TokenBucket
+
+    connection = Garmin(email=args.username, password=args.password, is_cn=False, prompt_mfa=None, cache=_response_cache(args),
+                        rate_limiter=TokenBucket(rate=args.rate), metrics=_metrics(), base_url=args.garmin_url, transport=transport)
+    connection.login(args.tokenstore)
+    return connection
+
+def _metrics():
+    global _METRICS
+    if _METRICS is None:
+        from clients.metrics import RequestMetrics
+        _METRICS = RequestMetrics()
+    return _METRICS
+
+def _transport(args, concurrency=1):
+    from clients.transport import HttpTransport
+
+    cassette = _cassette(args)
+    session = cassette.session() if cassette is not None else None
+    return HttpTransport(pool_size=max(args.pool_size, concurrency), read_timeout=args.timeout, session=session)
+
+def _cassette(args):
+    global _CASSETTE
+    if _CASSETTE is not None or (args.record is None and args.replay is None):
+        return _CASSETTE
+
+    from clients.icalclient import CalendarItem
+    from clients.replay import HttpCassette
+
+    if args.replay is not None:
+        _CASSETTE = HttpCassette.load(args.replay)
+        # The calendar window as it was on the day of the recording
+        CalendarItem.pinned_today = _CASSETTE.today
+        logging.info("Replaying %d requests recorded on %s from '%s'" % (len(_CASSETTE.interactions), _CASSETTE.today, args.replay))
+    else:
+        _CASSETTE = HttpCassette(args.record)
+    return _CASSETTE
+
+def _response_cache(args):
+    if args.cache_dir is None:
+        return None
+
+    from clients.cache import ResponseCache
+    return ResponseCache(os.path.join(args.cache_dir, "responses.db"))
+
 # def command_list(args):
 #     with _garmin_client(args) as connection:
 #         for workout in connection.list_workouts():
@@ -122,9 +498,21 @@ def command_sync(args):
 
 def main():
     parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter, description="Manage Garmin Connect workout(s)")
-    parser.add_argument("--username", "-u", required=True, help="Garmin Connect account username")
-    parser.add_argument("--password", "-p", required=True, help="Garmin Connect account password")
-    parser.add_argument("--cookie-jar", default=".garmin-cookies.txt", help="Filename with authentication cookies")
+    parser.add_argument("--username", "-u", help="Garmin Connect account username, only needed when there are no saved tokens")
+    parser.add_argument("--password", "-p", help="Garmin Connect account password, only needed when there are no saved tokens")
+    parser.add_argument("--tokenstore", "--cookie-jar", default=os.getenv("GARMINTOKENS", "~/.garminconnect"), help="Directory with the saved authentication tokens")
+    parser.add_argument("--cache-dir", default=None, help="Directory for the garmin response cache, disabled when not set")
+    parser.add_argument("--rate", type=float, default=2.0, help="Maximum garmin requests per second, lowered automatically when throttled")
+    parser.add_argument("--garmin-url", default=None, help="Send the garmin requests to this server instead, e.g. tools/fakegarmin.py")
+    parser.add_argument("--ical-url", default=None, help="Fetch the calendars from this server instead of google calendar")
+    parser.add_argument("--pool-size", type=int, default=10, help="Number of kept open connections per host")
+    parser.add_argument("--timeout", type=float, default=30.0, help="Seconds to wait for a response")
+    parser.add_argument("--metrics", default=None, help="Write a json summary of the garmin requests to this file at the end of the run")
+    parser.add_argument("--profile", default=None, help="Write a cProfile dump of the command to this file, read it with python -m pstats")
+    parser.add_argument("--tracemalloc", default=None, help="Write a tracemalloc snapshot taken at the end of the command to this file")
+    fixtures = parser.add_mutually_exclusive_group()
+    fixtures.add_argument("--record", default=None, help="Record the http requests and responses of the command to this json fixture")
+    fixtures.add_argument("--replay", default=None, help="Answer the http requests from a fixture made with --record, nothing goes to the network")
     parser.add_argument("--debug", action="store_true", help="Enables more detailed messages")
 
     subparsers = parser.add_subparsers(title="Commands")
@@ -134,6 +522,58 @@ def main():
     parser_sync.set_defaults(func=command_sync)
     parser_sync.add_argument("--id", required=True, help="Calendar id")
     parser_sync.add_argument("--name", required=True, help="Calendar name")
+    parser_sync.add_argument("--max-deletes", type=int, default=25, help="Do not remove any workout when more than this many would be removed")
+    parser_sync.add_argument("--workers", type=int, default=4, help="Number of parallel deletes")
+    parser_sync.add_argument("--timings", default=None, help="Write the json summary of the time, garmin calls and counts per sync phase to this file")
+    parser_sync.add_argument("--journal", default=None, help="Journal of the changes, an interrupted sync is finished by the next run. Defaults to sync.journal in --cache-dir")
+
+    parser_watch = subparsers.add_parser("watch", description="Keep syncing, only when the calendar changed")
+    parser_watch.set_defaults(func=command_watch)
+    parser_watch.add_argument("--id", required=True, action="append", help="Calendar id, repeat for more calendars")
+    parser_watch.add_argument("--name", required=True, action="append", help="Calendar name, one for every --id")
+    parser_watch.add_argument("--interval", type=float, default=300, help="Seconds between two polls")
+    parser_watch.add_argument("--jitter", type=float, default=0.1, help="Random part of the interval, 0.1 is plus or minus 10%%")
+    parser_watch.add_argument("--full-every", type=int, default=12, help="Also sync every this many polls when the calendar did not change, 0 never")
+    parser_watch.add_argument("--port", type=int, default=None, help="Serve /healthz and /metrics on this port")
+    parser_watch.add_argument("--bind", default="127.0.0.1", help="Address of --port, 0.0.0.0 for every interface")
+    parser_watch.add_argument("--webhook", action="store_true", help="Also sync on change notifications posted to /webhook on --port")
+    parser_watch.add_argument("--webhook-token", default=None, help="Secret the notifications must carry (X-Goog-Channel-Token or X-Webhook-Token), required with --webhook")
+    parser_watch.add_argument("--debounce", type=float, default=2.0, help="Seconds without notifications for a calendar before it is synced")
+    parser_watch.add_argument("--max-deletes", type=int, default=25, help="Do not remove any workout when more than this many would be removed")
+    parser_watch.add_argument("--workers", type=int, default=4, help="Number of parallel deletes")
+    parser_watch.add_argument("--journal", default=None, help="Journal of the changes. Defaults to sync.journal in --cache-dir")
+
+    parser_fit = subparsers.add_parser("fit", description="Write the workouts as FIT files, no garmin connect needed")
+    parser_fit.set_defaults(func=command_fit)
+    parser_fit.add_argument("--id", required=True, help="Calendar id")
+    parser_fit.add_argument("--name", required=True, help="Calendar name")
+    parser_fit.add_argument("--output", required=True, help="Output directory or the mount point of the watch (uses GARMIN/NewFiles)")
+
+    parser_export = subparsers.add_parser("export", description="Download all activities in a date range, skipping the ones already present")
+    parser_export.set_defaults(func=command_export)
+    parser_export.add_argument("--start", required=True, help="Start date, format YYYY-MM-DD")
+    parser_export.add_argument("--end", required=True, help="End date, format YYYY-MM-DD")
+    parser_export.add_argument("--output", required=True, help="Output directory")
+    parser_export.add_argument("--format", default="ORIGINAL", choices=_DOWNLOAD_FORMATS, help="Download format")
+    parser_export.add_argument("--workers", type=int, default=4, help="Number of parallel downloads")
+
+    parser_upload = subparsers.add_parser("upload", description="Upload all FIT, GPX and TCX files of a directory, skipping the ones uploaded before")
+    parser_upload.set_defaults(func=command_upload)
+    parser_upload.add_argument("--input", required=True, help="Directory with the activity files, searched recursively")
+    parser_upload.add_argument("--ledger", default=None, help="Database of the uploaded files, defaults to .garmin_uploads.db in the input directory")
+    parser_upload.add_argument("--workers", type=int, default=4, help="Number of parallel uploads")
+
+    parser_archive = subparsers.add_parser("archive", description="Mirror the activities into a local database and query it")
+    parser_archive.set_defaults(func=command_archive)
+    parser_archive.add_argument("--db", default="activities.db", help="Archive database file")
+    parser_archive.add_argument("--offline", action="store_true", help="Only query the archive, do not refresh it")
+    parser_archive.add_argument("--since", default=None, help="First refresh of an empty archive starts at this date instead of 2000-01-01, format YYYY-MM-DD")
+    parser_archive.add_argument("--splits", action="store_true", help="Also archive the splits of the activities that do not have them yet")
+    parser_archive.add_argument("--details", action="store_true", help="Also archive the details of the activities that do not have them yet")
+    parser_archive.add_argument("--workers", type=int, default=4, help="Number of parallel requests for splits and details")
+    parser_archive.add_argument("--start", default=None, help="List the archived activities from this date, format YYYY-MM-DD")
+    parser_archive.add_argument("--end", default=None, help="List the archived activities till this date, format YYYY-MM-DD")
+    parser_archive.add_argument("--type", default=None, help="List the archived activities of this type, e.g. running")
 
     # parser_list = subparsers.add_parser("list", description="List all workouts")
     # parser_list.set_defaults(func=command_list)
@@ -144,6 +584,7 @@ def main():
 
     parser_dry = subparsers.add_parser("dry", description="Dry run")
     parser_dry.add_argument("--name", required=True, help="The test workout name")
+    parser_dry.add_argument("--compact", action="store_true", help="Print the canonical compact payload as sent to garmin")
     parser_dry.set_defaults(func=command_dry)
 
     # parser_delete = subparsers.add_parser("delete", description="Delete workout")
@@ -155,7 +596,38 @@ def main():
     logging_level = logging.DEBUG if args.debug else logging.INFO
     logging.basicConfig(level=logging_level)
 
-    args.func(args)
+    try:
+        _run_profiled(args)
+    finally:
+        if args.metrics is not None:
+            with open(args.metrics, "w") as f:
+                f.write(_metrics().to_json())
+        if _CASSETTE is not None:
+            _CASSETTE.save()
+
+def _run_profiled(args):
+    if args.tracemalloc is not None:
+        import tracemalloc
+        # Enough frames to tell the callers of the parser and the payload code apart
+        tracemalloc.start(16)
+
+    profiler = None
+    if args.profile is not None:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    try:
+        args.func(args)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(args.profile)
+            logging.info("Profile written to '%s'" % args.profile)
+        if args.tracemalloc is not None:
+            tracemalloc.take_snapshot().dump(args.tracemalloc)
+            tracemalloc.stop()
+            logging.info("Memory snapshot written to '%s'" % args.tracemalloc)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,189 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+class ActivityArchive(object):
+    """
+    Local sqlite mirror of the Garmin Connect activity summaries, optionally with splits and details.
+    A refresh only asks for the activities since shortly before the high water mark of the previous
+    refresh, queries by date and type are answered from the indexes without network.
+    """
+
+    _FIRST_DATE = "2000-01-01"
+    _HIGH_WATER_MARK = "high_water_mark"
+
+    # Days before the high water mark that are asked again, for activities that reach Garmin Connect
+    # after newer ones, like those of a watch that is synced days later
+    _OVERLAP_DAYS = 14
+
+    # Activities are written in batches, one transaction each
+    _BATCH_SIZE = 200
+
+    _LOG = logging.getLogger(__name__)
+
+    def __init__(self, path):
+        self.path = path
+
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS activities (
+                activity_id INTEGER PRIMARY KEY, start_time TEXT NOT NULL, start_date TEXT NOT NULL,
+                type TEXT, name TEXT, distance REAL, duration REAL, summary BLOB NOT NULL);
+            CREATE INDEX IF NOT EXISTS activities_date ON activities (start_date);
+            CREATE INDEX IF NOT EXISTS activities_type_date ON activities (type, start_date);
+            CREATE TABLE IF NOT EXISTS activity_data (
+                activity_id INTEGER NOT NULL, kind TEXT NOT NULL, value BLOB NOT NULL,
+                PRIMARY KEY (activity_id, kind));
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+        """)
+        self._db.commit()
+
+    def high_water_mark(self):
+        """Start date of the newest archived activity, None for an empty archive"""
+        with self._lock:
+            row = self._db.execute("SELECT value FROM meta WHERE key = ?", (ActivityArchive._HIGH_WATER_MARK,)).fetchone()
+        return row[0] if row else None
+
+    def refresh(self, garmin, start=None, end=None, splits=False, details=False, workers=4):
+        """
+        Add the activities since _OVERLAP_DAYS before the high water mark, those days can have
+        activities that were uploaded after the previous refresh. 'start' is only used by the first
+        refresh of an empty archive, it begins at _FIRST_DATE otherwise. Splits and details are fetched
+        for every archived activity that does not have them yet, so the ones that failed before are
+        tried again. Returns the ids of the activities that were not in the archive yet.
+        """
+        mark = self.high_water_mark()
+        if mark is None:
+            start = start or ActivityArchive._FIRST_DATE
+        else:
+            start = (date.fromisoformat(mark) - timedelta(days=ActivityArchive._OVERLAP_DAYS)).isoformat()
+        end = end or date.today().isoformat()
+        ActivityArchive._LOG.info("Refreshing the archive from %s to %s" % (start, end))
+
+        new_ids = []
+        batch = []
+        for activity in garmin.iter_activities_by_date(start, end, page_size=100):
+            batch.append(activity)
+            if len(batch) >= ActivityArchive._BATCH_SIZE:
+                new_ids.extend(self._store(batch))
+                batch = []
+        new_ids.extend(self._store(batch))
+
+        kinds = []
+        if splits:
+            kinds.append(("splits", garmin.get_activity_splits))
+        if details:
+            kinds.append(("details", garmin.get_activity_details))
+        if kinds:
+            self._fetch_data(kinds, workers)
+        return new_ids
+
+    def _store(self, activities):
+        if not activities:
+            return []
+
+        rows = [ActivityArchive._row(a) for a in activities]
+        with self._lock:
+            ids = [r[0] for r in rows]
+            known = set(r[0] for r in self._db.execute(
+                "SELECT activity_id FROM activities WHERE activity_id IN (%s)" % ",".join("?" * len(ids)), ids))
+            with self._db:
+                self._db.executemany("INSERT OR REPLACE INTO activities VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+                newest = max(r[2] for r in rows)
+                self._db.execute("""INSERT INTO meta (key, value) VALUES (?, ?)
+                    ON CONFLICT (key) DO UPDATE SET value = MAX(value, excluded.value)""", (ActivityArchive._HIGH_WATER_MARK, newest))
+        return [i for i in ids if i not in known]
+
+    @staticmethod
+    def _row(activity):
+        start_time = activity.get("startTimeLocal") or activity.get("startTimeGMT") or ""
+        return (
+            activity["activityId"],
+            start_time,
+            start_time[:10],
+            (activity.get("activityType") or {}).get("typeKey"),
+            activity.get("activityName"),
+            activity.get("distance"),
+            activity.get("duration"),
+            ActivityArchive._dumps(activity),
+        )
+
+    @staticmethod
+    def _dumps(value):
+        # As received, nulls included, the archive is a faithful copy
+        return json.dumps(value, separators=(",", ":")).encode("utf-8")
+
+    def missing_data(self, kind):
+        """Ids of the archived activities without data of 'kind', newest first"""
+        with self._lock:
+            return [r[0] for r in self._db.execute("""SELECT activity_id FROM activities WHERE activity_id NOT IN
+                (SELECT activity_id FROM activity_data WHERE kind = ?) ORDER BY start_time DESC""", (kind,))]
+
+    def _fetch_data(self, kinds, workers):
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            jobs = [(activity_id, kind, pool.submit(fetch, activity_id)) for kind, fetch in kinds for activity_id in self.missing_data(kind)]
+            failed = 0
+            for activity_id, kind, future in jobs:
+                try:
+                    self.add_data(activity_id, kind, future.result())
+                except Exception as err:
+                    # Still missing, the next refresh asks again
+                    ActivityArchive._LOG.warning("Could not fetch the %s of activity %s: %s" % (kind, activity_id, err))
+                    failed = failed + 1
+        if jobs:
+            ActivityArchive._LOG.info("Fetched %d splits and details, %d failed" % (len(jobs) - failed, failed))
+
+    def add_data(self, activity_id, kind, value):
+        with self._lock, self._db:
+            self._db.execute("INSERT OR REPLACE INTO activity_data VALUES (?, ?, ?)", (activity_id, kind, ActivityArchive._dumps(value)))
+
+    def get_data(self, activity_id, kind):
+        with self._lock:
+            row = self._db.execute("SELECT value FROM activity_data WHERE activity_id = ? AND kind = ?", (activity_id, kind)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def query(self, start=None, end=None, activity_type=None):
+        """Activity summaries between the dates 'start' and 'end' (inclusive, YYYY-MM-DD), newest first"""
+        where = []
+        params = []
+        if start is not None:
+            where.append("start_date >= ?")
+            params.append(str(start))
+        if end is not None:
+            where.append("start_date <= ?")
+            params.append(str(end))
+        if activity_type is not None:
+            where.append("type = ?")
+            params.append(activity_type)
+
+        sql = "SELECT summary FROM activities"
+        if where:
+            sql = sql + " WHERE " + " AND ".join(where)
+        sql = sql + " ORDER BY start_time DESC"
+
+        with self._lock:
+            rows = self._db.execute(sql, params).fetchall()
+        return [json.loads(r[0]) for r in rows]
+
+    def types(self):
+        """Number of archived activities by type"""
+        with self._lock:
+            return dict(self._db.execute("SELECT type, COUNT(*) FROM activities GROUP BY type ORDER BY type").fetchall())
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM activities").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,131 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+class ResponseCache(object):
+    """
+    Size bounded LRU cache of Garmin Connect GET responses, stored in sqlite on disk.
+    Entries are keyed by account as well, accounts sharing a cache never get each other's responses.
+    """
+
+    DAY = 86400
+
+    # Default time to live by path prefix, the longest matching prefix wins. Paths without a ttl are not cached
+    _DEFAULT_TTLS = {
+        "/userprofile-service/userprofile/user-settings": DAY,
+        "/userprofile-service/socialProfile": DAY,
+        "/activity-service/activity/activityTypes": 7 * DAY,
+        "/device-service/deviceregistration/devices": DAY,
+        "/web-gateway/device-info/primary-training-device": DAY,
+        "/workout-service/workouts": 300,
+        "/workout-service/workout/": 300,
+        "/calendar-service/": 300,
+    }
+
+    # Writes to a service also make the cached responses of these services stale
+    _DEPENDENT_SERVICES = {
+        "workout-service": ("workout-service", "calendar-service"),
+        "activity-service": ("activity-service", "activitylist-service"),
+        "upload-service": ("activity-service", "activitylist-service"),
+    }
+
+    _DEFAULT_MAX_BYTES = 32 * 1024 * 1024
+
+    _LOG = logging.getLogger(__name__)
+
+    def __init__(self, path, max_bytes=_DEFAULT_MAX_BYTES, ttls=None):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttls = dict(ResponseCache._DEFAULT_TTLS)
+        if ttls is not None:
+            self.ttls.update(ttls)
+
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("""CREATE TABLE IF NOT EXISTS responses (
+            key TEXT PRIMARY KEY, path TEXT NOT NULL, value BLOB NOT NULL,
+            size INTEGER NOT NULL, expires REAL NOT NULL, used REAL NOT NULL)""")
+        self._db.execute("CREATE INDEX IF NOT EXISTS responses_used ON responses (used)")
+
+    def ttl(self, path):
+        """Time to live for the path, None when the path is not cached"""
+        path = ResponseCache._normalize(path)
+        match = None
+        for prefix in self.ttls:
+            if path.startswith(prefix) and (match is None or len(prefix) > len(match)):
+                match = prefix
+        return self.ttls[match] if match is not None else None
+
+    def get(self, path, params=None, account=""):
+        """Return (True, value) for a fresh entry of 'account', (False, None) otherwise"""
+        key = ResponseCache._key(path, params, account)
+        now = time.time()
+        with self._lock:
+            row = self._db.execute("SELECT value, expires FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return (False, None)
+            if row[1] < now:
+                self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                return (False, None)
+            self._db.execute("UPDATE responses SET used = ? WHERE key = ?", (now, key))
+
+        self._LOG.debug("Cache hit for %s" % key)
+        return (True, json.loads(row[0]))
+
+    def set(self, path, params, value, ttl=None, account=""):
+        ttl = self.ttl(path) if ttl is None else ttl
+        if not ttl:
+            return
+
+        key = ResponseCache._key(path, params, account)
+        data = json.dumps(value, separators=(",", ":")).encode("utf-8")
+        now = time.time()
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO responses (key, path, value, size, expires, used) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, ResponseCache._normalize(path), data, len(data), now + ttl, now))
+            self._evict()
+
+    def invalidate(self, path):
+        """Drop the cached responses of the service the path belongs to, and of the services depending on it, of every account"""
+        service = ResponseCache._normalize(path).split("/")[1]
+        with self._lock:
+            for s in ResponseCache._DEPENDENT_SERVICES.get(service, (service,)):
+                self._db.execute("DELETE FROM responses WHERE path LIKE ?", ("/%s%%" % s,))
+
+    def clear(self):
+        with self._lock:
+            self._db.execute("DELETE FROM responses")
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def _evict(self):
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        # Drop the least recently used entries until the cache fits again
+        for key, size in self._db.execute("SELECT key, size FROM responses ORDER BY used").fetchall():
+            self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+            total = total - size
+            if total <= self.max_bytes:
+                break
+
+    @staticmethod
+    def _normalize(path):
+        return "/" + path.lstrip("/")
+
+    @staticmethod
+    def _key(path, params, account=""):
+        key = ResponseCache._normalize(path)
+        if params:
+            key = key + "?" + "&".join("%s=%s" % (k, params[k]) for k in sorted(params))
+        return account + " " + key
@@ -1,13 +1,29 @@
 """Python 3 API wrapper for Garmin Connect."""
 
+import hashlib
+import itertools
 import logging
 import os
 import json
-from datetime import datetime, timezone, date
+import threading
+import time
+import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone, date, timedelta
 from enum import Enum, auto
 from typing import Any, Dict, List, Optional
 
 import garth
+import requests
+from garth.exc import GarthHTTPError
+
+from clients.cache import ResponseCache
+from clients.ledger import UploadLedger
+from clients.metrics import RequestMetrics
+from clients.paginator import Paginator
+from clients.ratelimit import RetryPolicy, TokenBucket
+from models.payload import Payload
 
 logger = logging.getLogger(__name__)
 
@@ -16,17 +32,40 @@ class Garmin:
     """Class for fetching data from Garmin Connect."""
 
     def __init__(
-        self, email=None, password=None, is_cn=False, prompt_mfa=None
+        self, email=None, password=None, is_cn=False, prompt_mfa=None,
+        cache=None, rate_limiter=None, retry_policy=None, metrics=None,
+        base_url=None, transport=None
     ):
-        """Create a new class instance."""
+        """
+        Create a new class instance.
+        'cache' is an optional ResponseCache for the connectapi GET requests.
+        'rate_limiter' is a TokenBucket, pass the same one to share it between clients.
+        'metrics' is the RequestMetrics every request is recorded in.
+        'base_url' sends the connectapi requests to another server, like
+        tools/fakegarmin.py, instead of Garmin Connect. No login is needed then.
+        'transport' is an HttpTransport whose session and pool are shared with
+        the other clients.
+        """
         self.username = email
         self.password = password
         self.is_cn = is_cn
         self.prompt_mfa = prompt_mfa
+        self.cache = cache
+        self.rate_limiter = rate_limiter or TokenBucket()
+        self.prefetch_pages = 2
+        self.range_workers = 4
+        self._local = threading.local()
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.metrics = metrics or RequestMetrics()
+        self.base_url = base_url.rstrip("/") if base_url else None
 
         self.garmin_connect_user_settings_url = (
             "/userprofile-service/userprofile/user-settings"
         )
+        self.garmin_connect_social_profile_url = (
+            "/userprofile-service/socialProfile"
+        )
+        self.garmin_profile_file = "garmin_profile.json"
         self.garmin_connect_devices_url = (
             "/device-service/deviceregistration/devices"
         )
@@ -182,41 +221,369 @@ class Garmin:
 
         self.garmin_connect_delete_activity_url = "/activity-service/activity"
 
-        self.garth = garth.Client(
-            domain="garmin.cn" if is_cn else "garmin.com"
-        )
+        # Throttled and failing responses are retried by _call, not by the session
+        self.transport = transport
+        if transport is not None:
+            self.garth = garth.Client(
+                session=transport.session,
+                domain="garmin.cn" if is_cn else "garmin.com",
+            )
+            self.garth.configure(status_forcelist=(), **transport.garth_options())
+        else:
+            self.garth = garth.Client(
+                domain="garmin.cn" if is_cn else "garmin.com"
+            )
+            self.garth.configure(status_forcelist=())
+
+        # The tokens of the last login or refresh, see _check_tokens
+        self._tokenstore = None
+        self._oauth1_token = None
+        self._oauth2_token = None
+        self._token_lock = threading.Lock()
+
+        # Profile fields are loaded on first use, see _profile_field
+        self._profile = {}
+        self._profile_path = None
+        self._profile_lock = threading.Lock()
+
+    def connectapi(self, path, cache_ttl=None, **kwargs):
+        """
+        GET 'path' from the connect api, served from the response cache
+        when there is a fresh entry. 'cache_ttl' overrides the cache ttl.
+        """
+        if self.cache is None or kwargs.get("method", "GET") != "GET":
+            return self._connectapi(path, **kwargs)
+
+        if cache_ttl is None:
+            cache_ttl = getattr(self._local, "cache_ttl", None)
+
+        params = kwargs.get("params")
+        account = self._cache_account()
+        hit, response = self.cache.get(path, params, account)
+        if not hit:
+            response = self._connectapi(path, **kwargs)
+            self.cache.set(path, params, response, ttl=cache_ttl, account=account)
 
-        self.display_name = None
-        self.full_name = None
-        self.unit_system = None
+        return response
 
-    def connectapi(self, path, **kwargs):
-        return self.garth.connectapi(path, **kwargs)
+    def _cache_account(self):
+        """
+        Account the cached responses belong to, so accounts sharing a cache
+        directory never get each other's workouts or calendar. A digest of
+        the OAuth1 token, which lasts as long as the login, or the base_url
+        when there is no login.
+        """
+        token = self.garth.oauth1_token
+        if token is not None:
+            return hashlib.sha256(token.oauth_token.encode("utf-8")).hexdigest()[:16]
+        return self.base_url or ""
+
+    def _connectapi(self, path, method="GET", **kwargs):
+        # Same as garth's connectapi, but through request so it is measured
+        response = self.request(method, "connectapi", path, api=True, **kwargs)
+        if response.status_code == 204:
+            return None
+        return response.json()
 
     def download(self, path, **kwargs):
-        return self.garth.download(path, **kwargs)
+        return self.request("GET", "connectapi", path, api=True, **kwargs).content
+
+    def request(self, method, subdomain, path, **kwargs):
+        """Send a request through garth, writes invalidate the cached responses."""
+
+        if kwargs.get("api") and self.base_url is None:
+            self._check_tokens()
+
+        # A POST creates something, it is not repeated after a server error
+        response = self._call(self._send, method, subdomain, path, idempotent=method.upper() != "POST", **kwargs)
+        if self.cache is not None and method.upper() != "GET":
+            self.cache.invalidate(path)
+
+        return response
+
+    def post(self, subdomain, path, **kwargs):
+        return self.request("POST", subdomain, path, **kwargs)
+
+    def put(self, subdomain, path, **kwargs):
+        return self.request("PUT", subdomain, path, **kwargs)
+
+    def _send(self, method, subdomain, path, **kwargs):
+        """A single garth request, recorded in the metrics."""
+
+        status = None
+        nbytes = 0
+        started = time.perf_counter()
+        try:
+            if self.base_url is not None:
+                response = self._send_base_url(method, path, **kwargs)
+            else:
+                response = self.garth.request(method, subdomain, path, **kwargs)
+            status = response.status_code
+            if kwargs.get("stream"):
+                nbytes = int(response.headers.get("Content-Length", 0))
+            else:
+                nbytes = len(response.content)
+            return response
+        except GarthHTTPError as err:
+            if err.error.response is not None:
+                status = err.error.response.status_code
+                nbytes = len(err.error.response.content or b"")
+            raise
+        finally:
+            display_name = self._profile.get("displayName")
+            if display_name:
+                self.metrics.user_segments.add(display_name)
+            self.metrics.record(
+                method, path, status, nbytes, time.perf_counter() - started
+            )
+
+    def _send_base_url(self, method, path, api=False, referrer=False, headers=None, **kwargs):
+        # Mirrors garth.request for a server at base_url
+        headers = dict(headers or {})
+        if api and self.garth.oauth2_token is not None:
+            headers["Authorization"] = str(self.garth.oauth2_token)
+
+        url = f"{self.base_url}/{path.lstrip('/')}"
+        response = self.garth.sess.request(
+            method, url, headers=headers, timeout=self.garth.timeout, **kwargs
+        )
+        try:
+            response.raise_for_status()
+        except requests.HTTPError as err:
+            raise GarthHTTPError(msg="Error in request", error=err)
+        return response
+
+    def _call(self, fn, *args, idempotent=True, **kwargs):
+        """
+        Call garth under the rate limiter. Throttled (429) and server error
+        responses are retried with backoff, honouring Retry-After. Calls
+        that are not idempotent are only retried when throttled.
+        """
+
+        attempt = 0
+        while True:
+            self.rate_limiter.acquire()
+            try:
+                response = fn(*args, **kwargs)
+            except GarthHTTPError as err:
+                status = err.error.response.status_code if err.error.response is not None else None
+                if status == 429:
+                    self.rate_limiter.throttled()
+
+                if not self.retry_policy.should_retry(status, attempt, idempotent):
+                    if status == 429:
+                        raise GarminConnectTooManyRequestsError(str(err)) from err
+                    if status in RetryPolicy.RETRY_STATUS:
+                        raise GarminConnectConnectionError(str(err)) from err
+                    raise
+
+                delay = self.retry_policy.delay(attempt, err.error.response.headers.get("Retry-After"))
+                logger.warning(
+                    f"Request failed with status {status}, retry {attempt + 1} in {delay:.1f}s"
+                )
+                time.sleep(delay)
+                attempt = attempt + 1
+                continue
+
+            self.rate_limiter.succeeded()
+            return response
 
     def login(self, /, tokenstore: Optional[str] = None):
-        """Log in using Garth."""
+        """
+        Log in using Garth.
+        Tokens are resumed from 'tokenstore', a directory or a base64 token
+        string (longer than 512 characters), and the OAuth2 token is
+        refreshed when it expired. The full SSO login only runs when there
+        are no usable tokens, the new tokens are then saved to the directory.
+        """
         tokenstore = tokenstore or os.getenv("GARMINTOKENS")
 
-        if tokenstore:
+        if self.base_url is not None:
+            logger.info(f"Using {self.base_url}, skipping login")
+            return True
+
+        self._tokenstore = tokenstore
+        with self._token_lock:
+            if not (tokenstore and self._resume_tokens(tokenstore)):
+                self._login_credentials()
+                # A new login may be another account
+                self._profile = {}
+                self._remove_profile(tokenstore)
+
+        if tokenstore and len(tokenstore) <= 512:
+            self._profile_path = os.path.join(
+                os.path.expanduser(tokenstore), self.garmin_profile_file
+            )
+
+        return True
+
+    def _resume_tokens(self, tokenstore: str):
+        """Load and if needed refresh the tokens, False when they are missing or rejected."""
+
+        try:
             if len(tokenstore) > 512:
                 self.garth.loads(tokenstore)
             else:
                 self.garth.load(tokenstore)
-        else:
-            self.garth.login(
-                self.username, self.password, prompt_mfa=self.prompt_mfa
+        except (OSError, ValueError, TypeError, KeyError) as err:
+            logger.debug(f"Could not load tokens from the tokenstore: {err}")
+            return False
+
+        if self.garth.oauth1_token is None or self.garth.oauth2_token is None:
+            logger.debug("No OAuth1 or OAuth2 token in the tokenstore")
+            return False
+
+        self._oauth1_token = self.garth.oauth1_token
+        if self.garth.oauth2_token.expired:
+            logger.debug("OAuth2 token expired, refreshing")
+            try:
+                self._refresh_oauth2()
+            except (GarthHTTPError, GarminConnectConnectionError, GarminConnectTooManyRequestsError) as err:
+                logger.info(f"Could not refresh the tokens: {err}")
+                return False
+            self._dump_tokens(tokenstore)
+
+        self._oauth2_token = self.garth.oauth2_token
+        return True
+
+    def _login_credentials(self):
+        """The full SSO login with username and password, the new tokens are saved."""
+
+        if not self.username or not self.password:
+            raise GarminConnectAuthenticationError(
+                "No usable tokens in the tokenstore, username and password are required"
             )
+        logger.info("Logging in with username and password")
+        self.garth.login(
+            self.username, self.password, prompt_mfa=self.prompt_mfa
+        )
+        self._oauth1_token = self.garth.oauth1_token
+        self._oauth2_token = self.garth.oauth2_token
+        self._dump_tokens(self._tokenstore)
 
-        self.display_name = self.garth.profile["displayName"]
-        self.full_name = self.garth.profile["fullName"]
+    def _refresh_oauth2(self):
+        """
+        Exchange the OAuth1 token for a new OAuth2 token under the retry
+        policy. garth drops the OAuth1 token when an exchange fails, it is
+        put back before every attempt so a retry or a later refresh can
+        still use it.
+        """
 
-        settings = self.garth.connectapi(self.garmin_connect_user_settings_url)
-        self.unit_system = settings["userData"]["measurementSystem"]
+        def refresh():
+            self.garth.oauth1_token = self._oauth1_token
+            try:
+                self.garth.refresh_oauth2()
+            except requests.HTTPError as err:
+                # The exchange raises the plain requests error
+                raise GarthHTTPError(msg="Error refreshing the OAuth2 token", error=err)
 
-        return True
+        try:
+            self._call(refresh)
+        finally:
+            self.garth.oauth1_token = self._oauth1_token
+
+    def _check_tokens(self):
+        """
+        Make sure an api request has usable tokens, so a long-running
+        process keeps working past the expiry of its OAuth2 token. An
+        expired token is refreshed here rather than by garth, which drops
+        the OAuth1 token when the refresh fails and never saves the new
+        token. A refresh that is rejected logs in again with the username
+        and password, a refresh that failed on a server error is tried
+        again on the next request.
+        """
+
+        with self._token_lock:
+            if self.garth.oauth1_token is None:
+                self.garth.oauth1_token = self._oauth1_token
+
+            token = self.garth.oauth2_token
+            if token is not None and not token.expired and self.garth.oauth1_token is not None:
+                # garth refreshed on its own between the check and a request
+                if token is not self._oauth2_token:
+                    self._oauth2_token = token
+                    self._dump_tokens(self._tokenstore)
+                return
+
+            if self._oauth1_token is None:
+                self._login_credentials()
+                return
+
+            logger.debug("OAuth2 token expired, refreshing")
+            try:
+                self._refresh_oauth2()
+            except GarthHTTPError as err:
+                logger.info(f"Could not refresh the tokens, logging in again: {err}")
+                self._login_credentials()
+                return
+
+            self._oauth2_token = self.garth.oauth2_token
+            self._dump_tokens(self._tokenstore)
+
+    def _dump_tokens(self, tokenstore: Optional[str]):
+        # A base64 token string from the environment cannot be written back
+        if tokenstore and len(tokenstore) <= 512:
+            self.garth.dump(tokenstore)
+            logger.debug(f"Tokens saved to {tokenstore}")
+
+    @property
+    def display_name(self):
+        return self._profile_field("displayName", self._load_social_profile)
+
+    @property
+    def full_name(self):
+        return self._profile_field("fullName", self._load_social_profile)
+
+    @property
+    def unit_system(self):
+        return self._profile_field("measurementSystem", self._load_user_settings)
+
+    def _profile_field(self, field, loader):
+        """
+        Return a profile field, loading the profile cached next to the
+        tokens or else requesting it from Garmin on first use.
+        """
+
+        with self._profile_lock:
+            if field not in self._profile and self._profile_path:
+                try:
+                    with open(self._profile_path) as f:
+                        self._profile.update(json.load(f))
+                except (OSError, ValueError):
+                    pass
+
+            if field not in self._profile:
+                # The profile can be loaded by a get_range day, it does not get the long ttl of the day
+                day_ttl = getattr(self._local, "cache_ttl", None)
+                self._local.cache_ttl = None
+                try:
+                    self._profile.update(loader())
+                finally:
+                    self._local.cache_ttl = day_ttl
+                if self._profile_path:
+                    with open(self._profile_path, "w") as f:
+                        json.dump(self._profile, f)
+
+            return self._profile[field]
+
+    def _load_social_profile(self):
+        profile = self.connectapi(self.garmin_connect_social_profile_url)
+        return {
+            "displayName": profile["displayName"],
+            "fullName": profile["fullName"],
+        }
+
+    def _load_user_settings(self):
+        settings = self.connectapi(self.garmin_connect_user_settings_url)
+        return {"measurementSystem": settings["userData"]["measurementSystem"]}
+
+    def _remove_profile(self, tokenstore: Optional[str]):
+        if tokenstore and len(tokenstore) <= 512:
+            path = os.path.join(
+                os.path.expanduser(tokenstore), self.garmin_profile_file
+            )
+            if os.path.isfile(path):
+                os.remove(path)
 
     def get_full_name(self):
         """Return full name."""
@@ -228,6 +595,63 @@ class Garmin:
 
         return self.unit_system
 
+    def paginate(self, url, params, start=0, page_size=20, prefetch=None):
+        """
+        Generator over all items of the paged endpoint 'url', using
+        'start' and 'limit' parameters. The next 'prefetch' pages are
+        requested concurrently while a page is consumed.
+        """
+
+        prefetch = self.prefetch_pages if prefetch is None else prefetch
+
+        def fetch(page_start, limit):
+            page_params = dict(params)
+            page_params["start"] = str(page_start)
+            page_params["limit"] = str(limit)
+            return self.connectapi(url, params=page_params)
+
+        return iter(Paginator(fetch, start=start, page_size=page_size, prefetch=prefetch))
+
+    def get_range(self, fetch, start, end, workers=None):
+        """
+        Call 'fetch(cdate)' for each day from 'start' through 'end' (format
+        'YYYY-MM-DD') on a bounded pool and yield (cdate, result) in date
+        order. Days that are cached are answered without a request, days
+        before yesterday do not change anymore and are cached for long.
+        """
+
+        workers = self.range_workers if workers is None else workers
+        first = date.fromisoformat(str(start))
+        last = date.fromisoformat(str(end))
+        settled = date.today() - timedelta(days=1)
+        days = (
+            first + timedelta(days=i) for i in range((last - first).days + 1)
+        )
+
+        logger.debug(f"Requesting {fetch.__name__} from {first} to {last}")
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            pending = deque()
+            for day in days:
+                cache_ttl = 30 * ResponseCache.DAY if day < settled else None
+                pending.append(
+                    (day, pool.submit(self._fetch_day, fetch, day, cache_ttl))
+                )
+                # Keep the window bounded so results stream in date order
+                if len(pending) >= workers * 2:
+                    day, future = pending.popleft()
+                    yield str(day), future.result()
+
+            while pending:
+                day, future = pending.popleft()
+                yield str(day), future.result()
+
+    def _fetch_day(self, fetch, day, cache_ttl):
+        self._local.cache_ttl = cache_ttl
+        try:
+            return fetch(str(day))
+        finally:
+            self._local.cache_ttl = None
+
     def get_stats(self, cdate: str) -> Dict[str, Any]:
         """
         Return user activity summary for 'cdate' format 'YYYY-MM-DD'
@@ -236,6 +660,11 @@ class Garmin:
 
         return self.get_user_summary(cdate)
 
+    def get_stats_range(self, start, end):
+        """Yield ('cdate', user activity summary) for each day from 'start' through 'end'."""
+
+        return self.get_range(self.get_stats, start, end)
+
     def get_user_summary(self, cdate: str) -> Dict[str, Any]:
         """Return user activity summary for 'cdate' format 'YYYY-MM-DD'."""
 
@@ -259,6 +688,11 @@ class Garmin:
 
         return self.connectapi(url, params=params)
 
+    def get_steps_data_range(self, start, end):
+        """Yield ('cdate', steps data) for each day from 'start' through 'end'."""
+
+        return self.get_range(self.get_steps_data, start, end)
+
     def get_floors(self, cdate):
         """Fetch available floors data 'cDate' format 'YYYY-MM-DD'."""
 
@@ -267,6 +701,11 @@ class Garmin:
 
         return self.connectapi(url)
 
+    def get_floors_range(self, start, end):
+        """Yield ('cdate', floors data) for each day from 'start' through 'end'."""
+
+        return self.get_range(self.get_floors, start, end)
+
     def get_daily_steps(self, start, end):
         """Fetch available steps data 'start' and 'end' format 'YYYY-MM-DD'."""
 
@@ -284,6 +723,11 @@ class Garmin:
 
         return self.connectapi(url, params=params)
 
+    def get_heart_rates_range(self, start, end):
+        """Yield ('cdate', heart rates data) for each day from 'start' through 'end'."""
+
+        return self.get_range(self.get_heart_rates, start, end)
+
     def get_stats_and_body(self, cdate):
         """Return activity data and body composition (compat for garminconnect)."""
 
@@ -326,7 +770,7 @@ class Garmin:
         }
         logger.debug("Adding weigh-in")
 
-        return self.garth.post("connectapi", url, json=payload)
+        return self.post("connectapi", url, json=payload)
 
     def get_weigh_ins(self, startdate: str, enddate: str):
         """Get weigh-ins between startdate and enddate using format 'YYYY-MM-DD'."""
@@ -351,7 +795,7 @@ class Garmin:
         url = f"{self.garmin_connect_weight_url}/weight/{cdate}/byversion/{weight_pk}"
         logger.debug("Deleting weigh-in")
 
-        return self.garth.request(
+        return self.request(
             "DELETE",
             "connectapi",
             url,
@@ -426,7 +870,7 @@ class Garmin:
 
         logger.debug("Adding blood pressure")
 
-        return self.garth.post("connectapi", url, json=payload)
+        return self.post("connectapi", url, json=payload)
 
     def get_blood_pressure(
         self, startdate: str, enddate=None
@@ -452,6 +896,11 @@ class Garmin:
 
         return self.connectapi(url)
 
+    def get_max_metrics_range(self, start, end):
+        """Yield ('cdate', max metric data) for each day from 'start' through 'end'."""
+
+        return self.get_range(self.get_max_metrics, start, end)
+
     def add_hydration_data(self, value_in_ml: float, timestamp=None, cdate: str=None) -> Dict[str, Any]:
         """Add hydration data in ml.  Defaults to current date and current timestamp if left empty
         :param float required - value_in_ml: The number of ml of water you wish to add (positive) or subtract (negative)
@@ -487,7 +936,7 @@ class Garmin:
 
         logger.debug("Adding hydration data")
 
-        return self.garth.put('connectapi', url, json=payload)
+        return self.put('connectapi', url, json=payload)
 
     def get_hydration_data(self, cdate: str) -> Dict[str, Any]:
         """Return available hydration data 'cdate' format 'YYYY-MM-DD'."""
@@ -497,6 +946,11 @@ class Garmin:
 
         return self.connectapi(url)
 
+    def get_hydration_data_range(self, start, end):
+        """Yield ('cdate', hydration data) for each day from 'start' through 'end'."""
+
+        return self.get_range(self.get_hydration_data, start, end)
+
     def get_respiration_data(self, cdate: str) -> Dict[str, Any]:
         """Return available respiration data 'cdate' format 'YYYY-MM-DD'."""
 
@@ -505,6 +959,11 @@ class Garmin:
 
         return self.connectapi(url)
 
+    def get_respiration_data_range(self, start, end):
+        """Yield ('cdate', respiration data) for each day from 'start' through 'end'."""
+
+        return self.get_range(self.get_respiration_data, start, end)
+
     def get_spo2_data(self, cdate: str) -> Dict[str, Any]:
         """Return available SpO2 data 'cdate' format 'YYYY-MM-DD'."""
 
@@ -513,6 +972,11 @@ class Garmin:
 
         return self.connectapi(url)
 
+    def get_spo2_data_range(self, start, end):
+        """Yield ('cdate', SpO2 data) for each day from 'start' through 'end'."""
+
+        return self.get_range(self.get_spo2_data, start, end)
+
     def get_all_day_stress(self, cdate: str) -> Dict[str, Any]:
         """Return available all day stress data 'cdate' format 'YYYY-MM-DD'."""
 
@@ -521,6 +985,11 @@ class Garmin:
 
         return self.connectapi(url)
 
+    def get_all_day_stress_range(self, start, end):
+        """Yield ('cdate', all day stress data) for each day from 'start' through 'end'."""
+
+        return self.get_range(self.get_all_day_stress, start, end)
+
     def get_personal_record(self) -> Dict[str, Any]:
         """Return personal records for current user."""
 
@@ -595,6 +1064,11 @@ class Garmin:
 
         return self.connectapi(url, params=params)
 
+    def get_sleep_data_range(self, start, end):
+        """Yield ('cdate', sleep data) for each day from 'start' through 'end'."""
+
+        return self.get_range(self.get_sleep_data, start, end)
+
     def get_stress_data(self, cdate: str) -> Dict[str, Any]:
         """Return stress data for current user."""
 
@@ -603,6 +1077,11 @@ class Garmin:
 
         return self.connectapi(url)
 
+    def get_stress_data_range(self, start, end):
+        """Yield ('cdate', stress data) for each day from 'start' through 'end'."""
+
+        return self.get_range(self.get_stress_data, start, end)
+
     def get_rhr_day(self, cdate: str) -> Dict[str, Any]:
         """Return resting heartrate data for current user."""
 
@@ -616,6 +1095,11 @@ class Garmin:
 
         return self.connectapi(url, params=params)
 
+    def get_rhr_day_range(self, start, end):
+        """Yield ('cdate', resting heartrate data) for each day from 'start' through 'end'."""
+
+        return self.get_range(self.get_rhr_day, start, end)
+
     def get_hrv_data(self, cdate: str) -> Dict[str, Any]:
         """Return Heart Rate Variability (hrv) data for current user."""
 
@@ -624,6 +1108,11 @@ class Garmin:
 
         return self.connectapi(url)
 
+    def get_hrv_data_range(self, start, end):
+        """Yield ('cdate', Heart Rate Variability (hrv) data) for each day from 'start' through 'end'."""
+
+        return self.get_range(self.get_hrv_data, start, end)
+
     def get_training_readiness(self, cdate: str) -> Dict[str, Any]:
         """Return training readiness data for current user."""
 
@@ -632,6 +1121,11 @@ class Garmin:
 
         return self.connectapi(url)
 
+    def get_training_readiness_range(self, start, end):
+        """Yield ('cdate', training readiness data) for each day from 'start' through 'end'."""
+
+        return self.get_range(self.get_training_readiness, start, end)
+
     def get_endurance_score(self, startdate: str, enddate=None):
         """
         Return endurance score by day for 'startdate' format 'YYYY-MM-DD'
@@ -709,6 +1203,11 @@ class Garmin:
 
         return self.connectapi(url)
 
+    def get_training_status_range(self, start, end):
+        """Yield ('cdate', training status data) for each day from 'start' through 'end'."""
+
+        return self.get_range(self.get_training_status, start, end)
+
     def get_hill_score(self, startdate: str, enddate=None):
         """
         Return hill score by day from 'startdate' format 'YYYY-MM-DD'
@@ -820,7 +1319,7 @@ class Garmin:
         url = f"{self.garmin_connect_activity}/{activity_id}"
         payload = {"activityId": activity_id, "activityName": title}
 
-        return self.garth.put("connectapi", url, json=payload, api=True)
+        return self.put("connectapi", url, json=payload, api=True)
 
     def get_last_activity(self):
         """Return last activity."""
@@ -842,23 +1341,90 @@ class Garmin:
         )
 
         if allowed_file_extension:
-            files = {
-                "file": (file_base_name, open(activity_path, "rb" or "r")),
-            }
+            # Read into memory, so a retried request sends the file again
+            with open(activity_path, "rb") as f:
+                files = {
+                    "file": (file_base_name, f.read()),
+                }
             url = self.garmin_connect_upload
-            return self.garth.post("connectapi", url, files=files, api=True)
+            return self.post("connectapi", url, files=files, api=True)
         else:
             raise GarminConnectInvalidFileFormatError(
                 f"Could not upload {activity_path}"
             )
 
+    def upload_activities(self, paths, ledger=None, workers=4):
+        """
+        Upload many activity files in parallel. Files whose content hash is
+        already in 'ledger', an UploadLedger, are skipped. Uploads that
+        Garmin Connect accepts or reports as duplicate are added to it.
+        Yields (path, result) as files complete, result is one of
+        "uploaded", "duplicate", "known" or "failed".
+        """
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {
+                pool.submit(self._upload_activity_once, path, ledger): path
+                for path in paths
+            }
+            for future in as_completed(futures):
+                path = futures[future]
+                try:
+                    result = future.result()
+                except (GarthHTTPError, GarminConnectConnectionError,
+                        GarminConnectTooManyRequestsError,
+                        GarminConnectInvalidFileFormatError, OSError) as err:
+                    logger.error(f"Upload of {path} failed: {err}")
+                    result = "failed"
+                yield path, result
+
+    def _upload_activity_once(self, path, ledger):
+        digest = UploadLedger.digest(path)
+        if ledger is not None and ledger.contains(digest):
+            return "known"
+
+        activity_id = None
+        try:
+            response = self.upload_activity(path)
+            result = response.json() if response.content else {}
+            import_result = result.get("detailedImportResult") or {}
+            successes = import_result.get("successes") or []
+            failures = import_result.get("failures") or []
+            if successes:
+                activity_id = successes[0].get("internalId")
+            if not successes and not all(Garmin._duplicate_failure(f) for f in failures):
+                # Rejected, e.g. a corrupt or unsupported file, left out of the ledger so it is tried again
+                logger.error(f"Upload of {path} was rejected: {failures}")
+                outcome = "failed"
+            elif any(Garmin._duplicate_failure(f) for f in failures):
+                outcome = "duplicate"
+            else:
+                outcome = "uploaded"
+        except GarthHTTPError as err:
+            response = err.error.response
+            if response is None or response.status_code != 409:
+                raise
+            outcome = "duplicate"
+
+        if ledger is not None and outcome in ("uploaded", "duplicate"):
+            ledger.add(digest, path, outcome, activity_id)
+        return outcome
+
+    @staticmethod
+    def _duplicate_failure(failure):
+        # Garmin Connect sometimes accepts a duplicate with a failure message instead of a 409
+        for message in failure.get("messages") or []:
+            if message.get("code") == 202 or "duplicate" in str(message.get("content", "")).lower():
+                return True
+        return False
+
     def delete_activity(self, activity_id):
         """Delete activity with specified id"""
 
         url = f"{self.garmin_connect_delete_activity_url}/{activity_id}"
         logger.debug("Deleting activity with id %s", activity_id)
 
-        return self.garth.request(
+        return self.request(
             "DELETE",
             "connectapi",
             url,
@@ -876,9 +1442,15 @@ class Garmin:
         :return: list of JSON activities
         """
 
-        activities = []
-        start = 0
-        limit = 20
+        return list(
+            self.iter_activities_by_date(startdate, enddate, activitytype)
+        )
+
+    def iter_activities_by_date(
+        self, startdate, enddate, activitytype=None, page_size=20
+    ):
+        """Generator version of get_activities_by_date."""
+
         # mimicking the behavior of the web interface that fetches
         # 20 activities at a time
         # and automatically loads more on scroll
@@ -886,8 +1458,6 @@ class Garmin:
         params = {
             "startDate": str(startdate),
             "endDate": str(enddate),
-            "start": str(start),
-            "limit": str(limit),
         }
         if activitytype:
             params["activityType"] = str(activitytype)
@@ -895,17 +1465,7 @@ class Garmin:
         logger.debug(
             f"Requesting activities by date from {startdate} to {enddate}"
         )
-        while True:
-            params["start"] = str(start)
-            logger.debug(f"Requesting activities {start} to {start+limit}")
-            act = self.connectapi(url, params=params)
-            if act:
-                activities.extend(act)
-                start = start + limit
-            else:
-                break
-
-        return activities
+        return self.paginate(url, params, page_size=page_size)
 
     def get_progress_summary_between_dates(
         self, startdate, enddate, metric="distance"
@@ -950,29 +1510,14 @@ class Garmin:
         :return: list of goals in JSON format
         """
 
-        goals = []
         url = self.garmin_connect_goals_url
         params = {
             "status": status,
-            "start": str(start),
-            "limit": str(limit),
             "sortOrder": "asc",
         }
 
         logger.debug(f"Requesting {status} goals")
-        while True:
-            params["start"] = str(start)
-            logger.debug(
-                f"Requesting {status} goals {start} to {start + limit - 1}"
-            )
-            goals_json = self.connectapi(url, params=params)
-            if goals_json:
-                goals.extend(goals_json)
-                start = start + limit
-            else:
-                break
-
-        return goals
+        return list(self.paginate(url, params, start=start, page_size=limit))
 
     def get_gear(self, userProfileNumber):
         """Return all user gear."""
@@ -1001,7 +1546,7 @@ class Garmin:
             f"{self.garmin_connect_gear_baseurl}{gearUUID}/"
             f"activityType/{activityType}{defaultGearString}"
         )
-        return self.garth.request(method_override, "connectapi", url, api=True)
+        return self.request(method_override, "connectapi", url, api=True)
 
     class ActivityDownloadFormat(Enum):
         """Activity variables."""
@@ -1012,6 +1557,21 @@ class Garmin:
         KML = auto()
         CSV = auto()
 
+    activity_download_extensions = {
+        ActivityDownloadFormat.ORIGINAL: "zip",
+        ActivityDownloadFormat.TCX: "tcx",
+        ActivityDownloadFormat.GPX: "gpx",
+        ActivityDownloadFormat.KML: "kml",
+        ActivityDownloadFormat.CSV: "csv",
+    }
+
+    # Last element of a complete download
+    activity_download_closing_tags = {
+        ActivityDownloadFormat.TCX: b"</TrainingCenterDatabase>",
+        ActivityDownloadFormat.GPX: b"</gpx>",
+        ActivityDownloadFormat.KML: b"</kml>",
+    }
+
     class ActivityUploadFormat(Enum):
         FIT = auto()
         GPX = auto()
@@ -1025,6 +1585,84 @@ class Garmin:
         "Original" will return the zip file content, up to user to extract it.
         "CSV" will return a csv of the splits.
         """
+        url = self._activity_download_url(activity_id, dl_fmt)
+
+        logger.debug("Downloading activities from %s", url)
+
+        return self.download(url)
+
+    def download_activity_to_file(
+        self, activity_id, path, dl_fmt=ActivityDownloadFormat.TCX,
+        chunk_size=64 * 1024
+    ):
+        """
+        Stream the activity download in chunks into 'path', so memory
+        stays flat for large files. The data goes to 'path'.part first and
+        is only renamed to 'path' once complete.
+        """
+
+        url = self._activity_download_url(activity_id, dl_fmt)
+        logger.debug("Streaming activity from %s to %s", url, path)
+
+        part_path = f"{path}.part"
+        response = self.request("GET", "connectapi", url, api=True, stream=True)
+        try:
+            with open(part_path, "wb") as f:
+                for chunk in response.iter_content(chunk_size=chunk_size):
+                    f.write(chunk)
+        finally:
+            response.close()
+
+        os.replace(part_path, path)
+        return path
+
+    def export_activities(
+        self, startdate, enddate, directory,
+        dl_fmt=ActivityDownloadFormat.ORIGINAL, workers=4
+    ):
+        """
+        Mirror all activities between 'startdate' and 'enddate' into
+        'directory', downloading in parallel. Files that are already
+        present and valid are skipped, so an interrupted export resumes.
+        Yields (activity_id, path, downloaded) as activities complete. A
+        failed download does not stop the export, it is yielded as
+        (activity_id, error, False).
+        """
+
+        os.makedirs(directory, exist_ok=True)
+        extension = Garmin.activity_download_extensions[dl_fmt]
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {}
+            for activity in self.iter_activities_by_date(startdate, enddate):
+                activity_id = activity["activityId"]
+                path = os.path.join(directory, f"{activity_id}.{extension}")
+                if Garmin._valid_download(path, dl_fmt):
+                    yield activity_id, path, False
+                    continue
+                future = pool.submit(
+                    self.download_activity_to_file, activity_id, path, dl_fmt
+                )
+                futures[future] = activity_id
+
+                # Report finished downloads while the listing continues
+                for future in [f for f in futures if f.done()]:
+                    yield Garmin._export_result(futures.pop(future), future)
+
+            for future in as_completed(futures):
+                yield Garmin._export_result(futures[future], future)
+
+    @staticmethod
+    def _export_result(activity_id, future):
+        try:
+            return activity_id, future.result(), True
+        except (GarthHTTPError, GarminConnectConnectionError,
+                GarminConnectTooManyRequestsError, OSError) as err:
+            # E.g. a 404 for the original file of a manually entered activity
+            logger.error(f"Download of activity {activity_id} failed: {err}")
+            return activity_id, err, False
+
+    def _activity_download_url(self, activity_id, dl_fmt):
         activity_id = str(activity_id)
         urls = {
             Garmin.ActivityDownloadFormat.ORIGINAL: f"{self.garmin_connect_fit_download}/{activity_id}",  # noqa
@@ -1035,11 +1673,25 @@ class Garmin:
         }
         if dl_fmt not in urls:
             raise ValueError(f"Unexpected value {dl_fmt} for dl_fmt")
-        url = urls[dl_fmt]
+        return urls[dl_fmt]
 
-        logger.debug("Downloading activities from %s", url)
+    @staticmethod
+    def _valid_download(path, dl_fmt):
+        """Check that a previous download is complete."""
 
-        return self.download(url)
+        if not os.path.isfile(path) or os.path.getsize(path) == 0:
+            return False
+
+        if dl_fmt == Garmin.ActivityDownloadFormat.ORIGINAL:
+            # A truncated zip has no central directory
+            return zipfile.is_zipfile(path)
+
+        closing_tag = Garmin.activity_download_closing_tags.get(dl_fmt)
+        if closing_tag is None:
+            return True
+        with open(path, "rb") as f:
+            f.seek(max(0, os.path.getsize(path) - 256))
+            return closing_tag in f.read()
 
     def get_activity_splits(self, activity_id):
         """Return activity splits."""
@@ -1145,15 +1797,17 @@ class Garmin:
         url = f"{self.garmin_request_reload_url}/{cdate}"
         logger.debug(f"Requesting reload of data for {cdate}.")
 
-        return self.garth.post("connectapi", url, api=True)
+        return self.post("connectapi", url, api=True)
 
-    def get_workouts(self, start=0, end=100):
-        """Return workouts from start till end."""
+    def get_workouts(self, start=0, end=None, page_size=100):
+        """Return workouts from start till end, all of them when end is None."""
 
         url = f"{self.garmin_workouts}/workouts"
         logger.debug(f"Requesting workouts from {start}-{end}")
-        params = {"start": start, "limit": end}
-        return self.connectapi(url, params=params)
+        workouts = self.paginate(url, {}, start=start, page_size=page_size)
+        if end is not None:
+            workouts = itertools.islice(workouts, max(0, end - start))
+        return list(workouts)
 
     def get_workout_by_id(self, workout_id):
         """Return workout by id."""
@@ -1169,28 +1823,82 @@ class Garmin:
 
         return self.download(url)
 
-    def upload_workout(self, workout_json: str):
-        """Upload workout using json data."""
+    def upload_workout(self, workout_json: Dict[str, Any]):
+        """Upload workout using json data, serialized in the compact canonical form."""
 
         url = f"{self.garmin_workouts}/workout"
         logger.debug("Uploading workout using %s", url)
 
-        response = self.garth.post("connectapi", url, json=workout_json, api=True)
+        response = self.post(
+            "connectapi",
+            url,
+            data=Payload.dumps(workout_json),
+            headers={"Content-Type": "application/json"},
+            api=True,
+        )
 
         return json.loads(response.text)
     
+    def update_workout(self, workout_id, workout_json: Dict[str, Any]):
+        """Replace workout with json data, its schedules are kept."""
+
+        url = f"{self.garmin_workouts}/workout/{workout_id}"
+        logger.debug("Updating workout using %s", url)
+
+        return self.put(
+            "connectapi",
+            url,
+            data=Payload.dumps(workout_json),
+            headers={"Content-Type": "application/json"},
+            api=True,
+        )
+
     def delete_workout(self, workout_id):
         """Delete specific workout"""
         url = f"{self.garmin_workouts}/workout/{workout_id}"
         logger.debug("Deleting workout")
 
-        return self.garth.request(
+        return self.request(
             "DELETE",
             "connectapi",
             url,
             api=True,
         )
 
+    def delete_workouts(self, workout_ids, workers=4, attempts=2):
+        """
+        Delete many workouts in parallel. A failed delete is tried again up
+        to 'attempts' times and does not stop the others, a workout that is
+        already gone counts as deleted. Yields (workout_id, error) as the
+        deletes finish, error is None on success.
+        """
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {
+                pool.submit(self._delete_workout_attempts, workout_id, attempts): workout_id
+                for workout_id in workout_ids
+            }
+            for future in as_completed(futures):
+                yield futures[future], future.result()
+
+    def _delete_workout_attempts(self, workout_id, attempts):
+        error = None
+        for attempt in range(attempts):
+            try:
+                self.delete_workout(workout_id)
+                return None
+            except GarthHTTPError as err:
+                response = err.error.response
+                if response is not None and response.status_code == 404:
+                    return None
+                error = err
+                if response is not None and response.status_code < 500:
+                    break
+            except (GarminConnectConnectionError, GarminConnectTooManyRequestsError, requests.RequestException) as err:
+                error = err
+            logger.warning(f"Deleting workout {workout_id} failed, attempt {attempt + 1} of {attempts}: {error}")
+        return error
+
     def schedule_workout(self, workout_id, str_date):
         """Schedule workout using json data."""
 
@@ -1199,15 +1907,33 @@ class Garmin:
         url = f"{self.garmin_workouts}/schedule/{workout_id}"
         logger.debug("Uploading workout using %s", url)
 
-        return self.garth.post("connectapi", url, json=schedule_json, api=True)
+        return self.post("connectapi", url, json=schedule_json, api=True)
     
+    def unschedule_workout(self, schedule_id):
+        """Remove a workout from the calendar, the workout itself is kept."""
+
+        url = f"{self.garmin_workouts}/schedule/{schedule_id}"
+        logger.debug("Deleting schedule %s", schedule_id)
+
+        return self.request("DELETE", "connectapi", url, api=True)
+
     def get_schedule(self, year, month):
-        """Return schedule for specified year and month"""
+        """
+        Return schedule for specified year and month.
+        The month is zero based like in the calendar service, 0 is January.
+        """
 
         url = f"{self.garmin_calendar}/year/{year}/month/{month}"
-        logger.debug(f"Requesting calendar {year}-{month}")
+        logger.debug(f"Requesting calendar {year}-{int(month) + 1}")
 
-        return self.connectapi(url)
+        # Months before the previous one do not change anymore
+        today = date.today()
+        cache_ttl = None
+        # Month ordinals, so the previous month of January is December of the year before
+        if int(year) * 12 + int(month) < today.year * 12 + (today.month - 1) - 1:
+            cache_ttl = 30 * ResponseCache.DAY
+
+        return self.connectapi(url, cache_ttl=cache_ttl)
 
     
     def get_menstrual_data_for_date(self, fordate: str):
@@ -0,0 +1,198 @@
+"""Asyncio client for the Garmin Connect workout and calendar endpoints."""
+
+import asyncio
+import logging
+from typing import Any, Dict, Optional
+
+import aiohttp
+
+from clients.garminapi import (
+    GarminConnectConnectionError,
+    GarminConnectTooManyRequestsError,
+)
+from clients.ratelimit import RetryPolicy, TokenBucket
+from models.payload import Payload
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncGarmin:
+    """
+    Async counterpart of the workout and schedule methods of Garmin.
+    It reuses the OAuth tokens of a logged in garth client, so one
+    process can keep many requests in flight for many accounts.
+    """
+
+    garmin_workouts = "/workout-service"
+    garmin_calendar = "/calendar-service"
+
+    def __init__(
+        self,
+        garth_client,
+        max_in_flight=32,
+        rate_limiter: Optional[TokenBucket] = None,
+        retry_policy: Optional[RetryPolicy] = None,
+        session: Optional[aiohttp.ClientSession] = None,
+    ):
+        """
+        Create a new class instance from a logged in 'garth_client'.
+        'session' is an optional aiohttp session to share between accounts.
+        """
+        self.garth = garth_client
+        self.base_url = f"https://connectapi.{garth_client.domain}"
+        self.rate_limiter = rate_limiter or TokenBucket()
+        self.retry_policy = retry_policy or RetryPolicy()
+
+        self._semaphore = asyncio.Semaphore(max_in_flight)
+        self._refresh_lock = asyncio.Lock()
+        self._session = session
+        self._owns_session = session is None
+
+    @classmethod
+    def from_garmin(cls, garmin, **kwargs):
+        """Create from a logged in Garmin, sharing its rate limiter."""
+
+        kwargs.setdefault("rate_limiter", garmin.rate_limiter)
+        kwargs.setdefault("retry_policy", garmin.retry_policy)
+        return cls(garmin.garth, **kwargs)
+
+    async def __aenter__(self):
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                headers={"User-Agent": self.garth.sess.headers["User-Agent"]}
+            )
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def close(self):
+        if self._owns_session and self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def get_workouts(self, start=0, end=100):
+        """Return workouts from start till end."""
+
+        url = f"{self.garmin_workouts}/workouts"
+        logger.debug(f"Requesting workouts from {start}-{end}")
+        params = {"start": start, "limit": end}
+        return await self._request("GET", url, params=params)
+
+    async def get_workout_by_id(self, workout_id):
+        """Return workout by id."""
+
+        url = f"{self.garmin_workouts}/workout/{workout_id}"
+        return await self._request("GET", url)
+
+    async def upload_workout(self, workout_json: Dict[str, Any]):
+        """Upload workout using json data, serialized in the compact canonical form."""
+
+        url = f"{self.garmin_workouts}/workout"
+        logger.debug("Uploading workout using %s", url)
+
+        return await self._request(
+            "POST",
+            url,
+            data=Payload.dumps(workout_json),
+            headers={"Content-Type": "application/json"},
+        )
+
+    async def update_workout(self, workout_id, workout_json: Dict[str, Any]):
+        """Replace workout with json data, its schedules are kept."""
+
+        url = f"{self.garmin_workouts}/workout/{workout_id}"
+        logger.debug("Updating workout using %s", url)
+
+        return await self._request(
+            "PUT",
+            url,
+            data=Payload.dumps(workout_json),
+            headers={"Content-Type": "application/json"},
+        )
+
+    async def delete_workout(self, workout_id):
+        """Delete specific workout"""
+
+        url = f"{self.garmin_workouts}/workout/{workout_id}"
+        logger.debug("Deleting workout")
+
+        return await self._request("DELETE", url)
+
+    async def schedule_workout(self, workout_id, str_date):
+        """Schedule workout using json data."""
+
+        url = f"{self.garmin_workouts}/schedule/{workout_id}"
+        logger.debug("Uploading workout using %s", url)
+
+        return await self._request("POST", url, json={"date": str_date})
+
+    async def unschedule_workout(self, schedule_id):
+        """Remove a workout from the calendar, the workout itself is kept."""
+
+        url = f"{self.garmin_workouts}/schedule/{schedule_id}"
+        logger.debug("Deleting schedule %s", schedule_id)
+
+        return await self._request("DELETE", url)
+
+    async def get_schedule(self, year, month):
+        """Return schedule for specified year and month, the month is zero based."""
+
+        url = f"{self.garmin_calendar}/year/{year}/month/{month}"
+        logger.debug(f"Requesting calendar {year}-{int(month) + 1}")
+
+        return await self._request("GET", url)
+
+    async def _authorization(self):
+        # garth refreshes with blocking requests, keep it off the event loop
+        token = self.garth.oauth2_token
+        if token is None or token.expired:
+            async with self._refresh_lock:
+                if self.garth.oauth2_token is None or self.garth.oauth2_token.expired:
+                    loop = asyncio.get_running_loop()
+                    await loop.run_in_executor(None, self.garth.refresh_oauth2)
+        return str(self.garth.oauth2_token)
+
+    async def _request(self, method, path, headers=None, **kwargs):
+        """
+        Send a request under the shared rate limiter, retrying throttled
+        (429) and server error responses like Garmin._call. A POST creates
+        something and is only retried when throttled.
+        """
+
+        assert self._session, "Use AsyncGarmin as an async context manager"
+
+        attempt = 0
+        async with self._semaphore:
+            while True:
+                await asyncio.sleep(self.rate_limiter.reserve())
+
+                request_headers = dict(headers or {})
+                request_headers["Authorization"] = await self._authorization()
+                async with self._session.request(
+                    method, self.base_url + path, headers=request_headers, **kwargs
+                ) as response:
+                    status = response.status
+                    if status < 400:
+                        self.rate_limiter.succeeded()
+                        if status == 204:
+                            return None
+                        return await response.json(content_type=None)
+
+                    retry_after = response.headers.get("Retry-After")
+                    message = f"{status} {response.reason} for {method} {path}"
+
+                if status == 429:
+                    self.rate_limiter.throttled()
+
+                if not self.retry_policy.should_retry(status, attempt, method.upper() != "POST"):
+                    if status == 429:
+                        raise GarminConnectTooManyRequestsError(message)
+                    raise GarminConnectConnectionError(message)
+
+                delay = self.retry_policy.delay(attempt, retry_after)
+                logger.warning(
+                    f"Request failed with status {status}, retry {attempt + 1} in {delay:.1f}s"
+                )
+                await asyncio.sleep(delay)
+                attempt = attempt + 1
@@ -0,0 +1,158 @@
+import hmac
+import json
+import logging
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from clients.webhook import WebhookRequest
+
+class WatchStatus(object):
+    """State of the watch loop, shared between the loop and the health endpoint"""
+
+    _PREFIX = "garmin_watch"
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.started = time.time()
+        self.polls = 0
+        self.syncs = 0
+        self.failures = 0
+        self.last_poll = None
+        self.last_sync = None
+        self.last_success = None
+        self.last_error = None
+        self._lock = threading.Lock()
+
+    def polled(self):
+        with self._lock:
+            self.polls = self.polls + 1
+            self.last_poll = time.time()
+
+    def synced(self, ok, error=None):
+        with self._lock:
+            self.syncs = self.syncs + 1
+            self.last_sync = time.time()
+            if ok:
+                self.last_success = self.last_sync
+                self.last_error = None
+            else:
+                self.failures = self.failures + 1
+                self.last_error = error
+
+    def healthy(self):
+        """Healthy while the last poll is recent and did not end in a failed sync"""
+        with self._lock:
+            if self.last_poll is None:
+                return time.time() - self.started < 3 * self.interval
+            return time.time() - self.last_poll < 3 * self.interval and self.last_error is None
+
+    def to_dict(self):
+        with self._lock:
+            status = {
+                "uptime": round(time.time() - self.started, 1),
+                "polls": self.polls,
+                "syncs": self.syncs,
+                "failures": self.failures,
+                "last_poll": self.last_poll,
+                "last_sync": self.last_sync,
+                "last_success": self.last_success,
+                "last_error": self.last_error,
+            }
+        status["healthy"] = self.healthy()
+        return status
+
+    def prometheus(self):
+        p = WatchStatus._PREFIX
+        status = self.to_dict()
+        lines = []
+        for name, kind, value in (
+            ("polls_total", "counter", status["polls"]),
+            ("syncs_total", "counter", status["syncs"]),
+            ("sync_failures_total", "counter", status["failures"]),
+            ("last_success_timestamp_seconds", "gauge", status["last_success"] or 0),
+            ("healthy", "gauge", 1 if status["healthy"] else 0),
+        ):
+            lines.append("# TYPE %s_%s %s" % (p, name, kind))
+            lines.append("%s_%s %s" % (p, name, value))
+        return "\n".join(lines) + "\n"
+
+class HealthServer(ThreadingHTTPServer):
+    """
+    Serves /healthz (json, 503 when unhealthy) and /metrics (Prometheus) of a watch loop.
+    With a SyncTrigger it also takes calendar change notifications on POST /webhook, only
+    the ones that carry 'token'.
+    """
+
+    daemon_threads = True
+
+    _LOG = logging.getLogger(__name__)
+
+    def __init__(self, address, status, metrics, trigger=None, calendars=(), token=None):
+        ThreadingHTTPServer.__init__(self, address, HealthHandler)
+        self.status = status
+        self.metrics = metrics
+        self.trigger = trigger
+        self.calendars = set(calendars)
+        self.token = token
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        HealthServer._LOG.info("Health and metrics on http://%s:%d" % self.server_address[:2])
+        return thread
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+class HealthHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path == "/healthz":
+            status = self.server.status.to_dict()
+            self._send(200 if status["healthy"] else 503, json.dumps(status), "application/json")
+        elif self.path == "/metrics":
+            text = self.server.status.prometheus() + self.server.metrics.prometheus()
+            self._send(200, text, "text/plain; version=0.0.4")
+        else:
+            self._send(404, "Not found", "text/plain")
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length) if length else b""
+
+        server = self.server
+        if server.trigger is None or not self.path.startswith("/webhook"):
+            self._send(404, "Not found", "text/plain")
+            return
+        # Without a token nothing is accepted, any client that reaches the port could trigger syncs.
+        # Compared as bytes, compare_digest raises on str with characters outside ascii. The headers are
+        # read as latin-1, encoding back gives the bytes that were sent.
+        token = (WebhookRequest.token(self.headers) or "").encode("latin-1", "replace")
+        if not server.token or not hmac.compare_digest(token, server.token.encode("utf-8")):
+            self._send(403, "Forbidden", "text/plain")
+            return
+
+        calendar_id = WebhookRequest.calendar_id(self.path, self.headers, body)
+        if calendar_id is None:
+            self._send(400, "No calendar in the notification", "text/plain")
+        elif calendar_id == "":
+            self._send(200, "", "text/plain")
+        elif calendar_id not in server.calendars:
+            self._send(404, "Calendar is not watched", "text/plain")
+        else:
+            server.trigger.notify(calendar_id)
+            self._send(202, "", "text/plain")
+
+    def log_message(self, format, *args):
+        logging.getLogger(__name__).debug(format % args)
+
+    def _send(self, status, text, content_type):
+        data = text.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
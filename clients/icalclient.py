@@ -6,9 +6,13 @@ import requests
 
 from datetime import datetime, date, timedelta
 
+from clients.transport import HttpTransport
+
 class ICalClient(object):
 
-    _ICAL_URL = "https://calendar.google.com/calendar/ical/%s@group.calendar.google.com/%s/basic.ics"
+    _ICAL_BASE_URL = "https://calendar.google.com"
+    _ICAL_PATH = "/calendar/ical/%s@group.calendar.google.com/%s/basic.ics"
+    _TIMEOUT = (HttpTransport.CONNECT_TIMEOUT, HttpTransport.READ_TIMEOUT)
 
     _LOG = logging.getLogger(__name__)
 
@@ -49,19 +53,68 @@ class ICalClient(object):
         return self.lines_to_container(re.split("\r?\n|\r", txt))
 
     @staticmethod
-    def get_events(calendar_id, calendar_name):
-        cal_url = ICalClient._ICAL_URL % (calendar_id, calendar_name)
+    def get_events(calendar_id, calendar_name, base_url=None, transport=None):
+        url_get = ICalClient.fetch(calendar_id, calendar_name, base_url, transport)
+        
+        return ICalClient().string_to_container(url_get.text)
+
+    @staticmethod
+    def fetch(calendar_id, calendar_name, base_url=None, transport=None, headers=None):
+        """The response for the calendar ics, 'headers' can make it a conditional request"""
+        base_url = ICalClient._ICAL_BASE_URL if base_url is None else base_url.rstrip("/")
+        cal_url = base_url + ICalClient._ICAL_PATH % (calendar_id, calendar_name)
 
         ICalClient._LOG.info("Fetching %s" % cal_url)
-        url_get = requests.get(cal_url)
+        if transport is not None:
+            url_get = transport.get(cal_url, headers=headers)
+        else:
+            url_get = requests.get(cal_url, headers=headers, timeout=ICalClient._TIMEOUT)
         url_get.raise_for_status()
-        
-        return ICalClient().string_to_container(url_get.text)
+
+        return url_get
 
     @staticmethod
     def get_today():
         return datetime.today()
 
+class CalendarFeed(object):
+    """
+    A calendar that is polled with conditional requests (ETag and Last-Modified). The events are only
+    parsed again when the calendar changed, or when a new day moved the window of the valid items.
+    """
+
+    def __init__(self, calendar_id, calendar_name, base_url=None, transport=None):
+        self.calendar_id = calendar_id
+        self.calendar_name = calendar_name
+        self.base_url = base_url
+        self.transport = transport
+        self.etag = None
+        self.last_modified = None
+        self.events = []
+        self._text = None
+        self._parsed_on = None
+
+    def poll(self):
+        """Fetch the calendar when it changed, returns True when the events changed"""
+        headers = {}
+        if self.etag is not None:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified is not None:
+            headers["If-Modified-Since"] = self.last_modified
+
+        url_get = ICalClient.fetch(self.calendar_id, self.calendar_name, self.base_url, self.transport, headers)
+        if url_get.status_code == 304 or url_get.text == self._text:
+            if self._parsed_on == date.today():
+                return False
+        else:
+            self._text = url_get.text
+            self.etag = url_get.headers.get("ETag")
+            self.last_modified = url_get.headers.get("Last-Modified")
+
+        self.events = ICalClient().string_to_container(self._text)
+        self._parsed_on = date.today()
+        return True
+
 class CalendarItem(object):
     
     _ITEM_UID = "UID"
@@ -71,6 +124,12 @@ class CalendarItem(object):
     _ITEM_START_DT = "DTSTART"
     _ITEM_LAST_MODIFIED = "LAST-MODIFIED"
 
+    _WINDOW_PAST_DAYS = 2
+    _WINDOW_FUTURE_DAYS = 7
+
+    # Date the window is counted from instead of today, set when a recorded session is replayed
+    pinned_today = None
+
     FORMATS = {
         8: "%Y%m%d",
         15: "%Y%m%dT%H%M%S"
@@ -78,7 +137,7 @@ class CalendarItem(object):
 
     def __init__(self, item):
         self.item = item
-        self.uid = str(item[CalendarItem._ITEM_UID])[:2]
+        self.uid = str(item[CalendarItem._ITEM_UID])
         self.title = item[CalendarItem._ITEM_TITLE]
         self.description = item[CalendarItem._ITEM_DESCRIPTION].encode("utf-8").decode("unicode_escape")
 
@@ -102,6 +161,12 @@ class CalendarItem(object):
 
         return False
 
+    @staticmethod
+    def window():
+        """First and last date of the synced calendar items"""
+        today = CalendarItem.pinned_today or date.today()
+        return today - timedelta(days=CalendarItem._WINDOW_PAST_DAYS), today + timedelta(days=CalendarItem._WINDOW_FUTURE_DAYS)
+
     def get_dt_start(self):
         return self.dt_start.strftime("%Y-%m-%d")
 
@@ -109,8 +174,7 @@ class CalendarItem(object):
         if self.dt_start is None:
             return False
         # enkel items nemen voor komende week + tot eergisteren
-        dt_min = date.today() - timedelta(days=2)
-        dt_max = date.today() + timedelta(days=7)
+        dt_min, dt_max = CalendarItem.window()
         
         dt_start = self.dt_start.date()
         print("%s - %s <= %s and dtstart >= %s" % (self.title, dt_start, dt_min, dt_max))
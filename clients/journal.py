@@ -0,0 +1,105 @@
+import json
+import logging
+import os
+import threading
+import time
+
+class SyncJournal(object):
+    """
+    Append-only write-ahead journal of the changes a sync makes on Garmin Connect.
+    Every change is written as an intent before it is sent and marked done after, so a sync that
+    died halfway leaves its unfinished changes behind for the next run. Records reach the os
+    before the request is sent, fsync is batched: every 'fsync_every' records or 'fsync_interval' seconds.
+    """
+
+    _INTENT = "intent"
+    _DONE = "done"
+
+    _LOG = logging.getLogger(__name__)
+
+    def __init__(self, path, fsync_every=32, fsync_interval=1.0):
+        self.path = path
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        self._lock = threading.Lock()
+        self._intents = {}
+        self._seq = 0
+        self._load()
+
+        self._file = open(path, "a", encoding="utf-8")
+        self._unsynced = 0
+        self._synced = time.monotonic()
+
+    def _load(self):
+        if not os.path.isfile(self.path):
+            return
+
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # The last line of a journal that died during a write
+                    SyncJournal._LOG.warning("Skipping a truncated journal record")
+                    continue
+                self._seq = max(self._seq, record["seq"])
+                if record["state"] == SyncJournal._INTENT:
+                    self._intents[record["seq"]] = record
+                else:
+                    self._intents.pop(record["seq"], None)
+
+    def pending(self):
+        """Intents without a done record, in the order they were written: (seq, op, args)"""
+        with self._lock:
+            return [(r["seq"], r["op"], r["args"]) for r in sorted(self._intents.values(), key=lambda r: r["seq"])]
+
+    def intend(self, op, **args):
+        """Record that 'op' is about to be sent, returns the sequence number for done"""
+        with self._lock:
+            self._seq = self._seq + 1
+            record = {"seq": self._seq, "state": SyncJournal._INTENT, "op": op, "args": args}
+            self._intents[self._seq] = record
+            self._append(record)
+            return self._seq
+
+    def done(self, seq, result=None):
+        with self._lock:
+            self._intents.pop(seq, None)
+            self._append({"seq": seq, "state": SyncJournal._DONE, "result": result})
+
+    def _append(self, record):
+        self._file.write(json.dumps(record, separators=(",", ":")) + "\n")
+        self._file.flush()
+        self._unsynced = self._unsynced + 1
+        if self._unsynced >= self.fsync_every or time.monotonic() - self._synced >= self.fsync_interval:
+            self._fsync()
+
+    def _fsync(self):
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+        self._synced = time.monotonic()
+
+    def compact(self):
+        """Drop the finished records, only the pending intents are kept"""
+        with self._lock:
+            self._file.close()
+            part_path = self.path + ".part"
+            with open(part_path, "w", encoding="utf-8") as f:
+                for seq in sorted(self._intents):
+                    f.write(json.dumps(self._intents[seq], separators=(",", ":")) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(part_path, self.path)
+            self._file = open(self.path, "a", encoding="utf-8")
+            self._unsynced = 0
+
+    def close(self):
+        with self._lock:
+            if self._unsynced:
+                self._fsync()
+            self._file.close()
@@ -0,0 +1,53 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+class UploadLedger(object):
+    """Content hashes of the activity files already on Garmin Connect, stored in sqlite on disk"""
+
+    _CHUNK_SIZE = 1024 * 1024
+
+    _LOG = logging.getLogger(__name__)
+
+    def __init__(self, path):
+        self.path = path
+
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("""CREATE TABLE IF NOT EXISTS uploads (
+            digest TEXT PRIMARY KEY, path TEXT NOT NULL, result TEXT NOT NULL,
+            activity_id INTEGER, uploaded REAL NOT NULL)""")
+
+    @staticmethod
+    def digest(path):
+        """sha256 of the file content, the same activity under another name has the same digest"""
+        sha = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(UploadLedger._CHUNK_SIZE), b""):
+                sha.update(chunk)
+        return sha.hexdigest()
+
+    def contains(self, digest):
+        with self._lock:
+            row = self._db.execute("SELECT 1 FROM uploads WHERE digest = ?", (digest,)).fetchone()
+        return row is not None
+
+    def add(self, digest, path, result, activity_id=None):
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO uploads (digest, path, result, activity_id, uploaded) VALUES (?, ?, ?, ?, ?)",
+                (digest, path, result, activity_id, time.time()))
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM uploads").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,166 @@
+import contextlib
+import json
+import re
+import threading
+import time
+
+class RequestMetrics(object):
+    """Call counts, bytes, status codes and latency histograms per endpoint template"""
+
+    # Upper bounds in seconds of the latency histogram buckets
+    _BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float("inf"))
+
+    _SEGMENT_TEMPLATES = (
+        (re.compile(r"^\d+$"), "{id}"),
+        (re.compile(r"^\d{4}-\d{2}-\d{2}$"), "{date}"),
+        (re.compile(r"^[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}$"), "{uuid}"),
+    )
+
+    _PREFIX = "garmin"
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._endpoints = {}
+        self.user_segments = set()
+
+    def template(self, path):
+        """Endpoint template of a path, ids, dates and user names are replaced by placeholders"""
+        segments = []
+        for segment in path.split("?", 1)[0].strip("/").split("/"):
+            if segment in self.user_segments:
+                segment = "{user}"
+            else:
+                for regex, placeholder in RequestMetrics._SEGMENT_TEMPLATES:
+                    if regex.match(segment):
+                        segment = placeholder
+                        break
+            segments.append(segment)
+        return "/" + "/".join(segments)
+
+    def record(self, method, path, status, nbytes, seconds):
+        key = (method.upper(), self.template(path))
+        with self._lock:
+            endpoint = self._endpoints.get(key)
+            if endpoint is None:
+                endpoint = self._endpoints[key] = {
+                    "count": 0,
+                    "bytes": 0,
+                    "status": {},
+                    "latency_sum": 0.0,
+                    "latency_max": 0.0,
+                    "buckets": [0] * len(RequestMetrics._BUCKETS)
+                }
+            endpoint["count"] = endpoint["count"] + 1
+            endpoint["bytes"] = endpoint["bytes"] + nbytes
+            status = str(status) if status is not None else "error"
+            endpoint["status"][status] = endpoint["status"].get(status, 0) + 1
+            endpoint["latency_sum"] = endpoint["latency_sum"] + seconds
+            endpoint["latency_max"] = max(endpoint["latency_max"], seconds)
+            for i, bound in enumerate(RequestMetrics._BUCKETS):
+                if seconds <= bound:
+                    endpoint["buckets"][i] = endpoint["buckets"][i] + 1
+                    break
+
+    def total_calls(self):
+        with self._lock:
+            return sum(e["count"] for e in self._endpoints.values())
+
+    def summary(self):
+        with self._lock:
+            endpoints = []
+            for (method, template), e in sorted(self._endpoints.items()):
+                endpoints.append({
+                    "method": method,
+                    "endpoint": template,
+                    "count": e["count"],
+                    "bytes": e["bytes"],
+                    "status": dict(e["status"]),
+                    "latency": {
+                        "sum": round(e["latency_sum"], 4),
+                        "avg": round(e["latency_sum"] / e["count"], 4),
+                        "max": round(e["latency_max"], 4),
+                        "buckets": { RequestMetrics._bucket_label(b): n for b, n in zip(RequestMetrics._BUCKETS, e["buckets"]) }
+                    }
+                })
+
+        return {
+            "calls": sum(e["count"] for e in endpoints),
+            "bytes": sum(e["bytes"] for e in endpoints),
+            "seconds": round(sum(e["latency"]["sum"] for e in endpoints), 4),
+            "endpoints": endpoints
+        }
+
+    def to_json(self):
+        return json.dumps(self.summary(), indent=2)
+
+    def prometheus(self):
+        """The metrics in the Prometheus text exposition format"""
+        p = RequestMetrics._PREFIX
+        lines = [
+            "# HELP %s_requests_total Garmin Connect requests by endpoint and status." % p,
+            "# TYPE %s_requests_total counter" % p,
+        ]
+        with self._lock:
+            items = sorted(self._endpoints.items())
+
+            for (method, template), e in items:
+                for status, n in sorted(e["status"].items()):
+                    lines.append('%s_requests_total{method="%s",endpoint="%s",status="%s"} %d' % (p, method, template, status, n))
+
+            lines.append("# HELP %s_response_bytes_total Garmin Connect response bytes by endpoint." % p)
+            lines.append("# TYPE %s_response_bytes_total counter" % p)
+            for (method, template), e in items:
+                lines.append('%s_response_bytes_total{method="%s",endpoint="%s"} %d' % (p, method, template, e["bytes"]))
+
+            lines.append("# HELP %s_request_duration_seconds Garmin Connect request latency by endpoint." % p)
+            lines.append("# TYPE %s_request_duration_seconds histogram" % p)
+            for (method, template), e in items:
+                cumulative = 0
+                for bound, n in zip(RequestMetrics._BUCKETS, e["buckets"]):
+                    cumulative = cumulative + n
+                    lines.append('%s_request_duration_seconds_bucket{method="%s",endpoint="%s",le="%s"} %d'
+                        % (p, method, template, RequestMetrics._bucket_label(bound), cumulative))
+                lines.append('%s_request_duration_seconds_sum{method="%s",endpoint="%s"} %f' % (p, method, template, e["latency_sum"]))
+                lines.append('%s_request_duration_seconds_count{method="%s",endpoint="%s"} %d' % (p, method, template, e["count"]))
+
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _bucket_label(bound):
+        return "+Inf" if bound == float("inf") else ("%g" % bound)
+
+class PhaseTimer(object):
+    """Wall time and garmin calls of the phases of a command, with counts of what it handled"""
+
+    def __init__(self, metrics=None):
+        self.metrics = metrics
+        self.phases = {}
+        self.counts = {}
+        self._started = time.perf_counter()
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Time the block, a phase that runs again adds up"""
+        calls = self.metrics.total_calls() if self.metrics is not None else 0
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            phase = self.phases.setdefault(name, {"seconds": 0.0, "calls": 0})
+            phase["seconds"] = phase["seconds"] + time.perf_counter() - started
+            if self.metrics is not None:
+                phase["calls"] = phase["calls"] + self.metrics.total_calls() - calls
+
+    def count(self, name, n):
+        self.counts[name] = self.counts.get(name, 0) + n
+
+    def summary(self):
+        return {
+            "seconds": round(time.perf_counter() - self._started, 4),
+            "calls": sum(p["calls"] for p in self.phases.values()),
+            "phases": { name: {"seconds": round(p["seconds"], 4), "calls": p["calls"]} for name, p in self.phases.items() },
+            "counts": dict(self.counts),
+        }
+
+    def to_json(self, indent=None):
+        return json.dumps(self.summary(), indent=indent)
@@ -0,0 +1,68 @@
+import logging
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+class Paginator(object):
+    """
+    Yields the items of a paged endpoint. Iteration stops at the first page with fewer items than
+    asked for. Only after a full page, so when there are more pages, the next 'prefetch' pages are
+    requested concurrently while a page is consumed.
+    """
+
+    _LOG = logging.getLogger(__name__)
+
+    def __init__(self, fetch, start=0, page_size=20, prefetch=2):
+        """'fetch' is called as fetch(start, limit) and returns the list of items of that page"""
+        self.fetch = fetch
+        self.start = start
+        self.page_size = page_size
+        self.prefetch = prefetch
+
+    def __iter__(self):
+        if self.prefetch < 1:
+            return self._serial()
+        return self._concurrent()
+
+    def _serial(self):
+        start = self.start
+        while True:
+            page = self._fetch(start)
+            yield from page
+            if self._last(page):
+                return
+            start = start + self.page_size
+
+    def _concurrent(self):
+        # Most listings fit in one page, nothing is speculated before that is known
+        page = self._fetch(self.start)
+        yield from page
+        if self._last(page):
+            return
+
+        pool = ThreadPoolExecutor(max_workers=self.prefetch)
+        pending = deque()
+        next_start = self.start + self.page_size
+        try:
+            # The page being read plus the speculative ones
+            for i in range(self.prefetch + 1):
+                pending.append(pool.submit(self._fetch, next_start))
+                next_start = next_start + self.page_size
+
+            while pending:
+                page = pending.popleft().result()
+                yield from page
+                if self._last(page):
+                    return
+                pending.append(pool.submit(self._fetch, next_start))
+                next_start = next_start + self.page_size
+        finally:
+            # Also runs when the caller stops early, drop the pages nobody will read
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def _last(self, page):
+        return len(page) < self.page_size
+
+    def _fetch(self, start):
+        self._LOG.debug("Requesting page %d to %d" % (start, start + self.page_size - 1))
+        return self.fetch(start, self.page_size)
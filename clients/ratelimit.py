@@ -0,0 +1,90 @@
+import logging
+import random
+import threading
+import time
+
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+class TokenBucket(object):
+    """
+    Thread safe token bucket, shared by every request of a client.
+    The rate adapts: it is halved on each throttled response and creeps back up on success,
+    so sustained throughput settles just under the server limit.
+    """
+
+    _LOG = logging.getLogger(__name__)
+
+    def __init__(self, rate=2.0, burst=4, min_rate=0.1, recovery=0.05):
+        self.max_rate = float(rate)
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.min_rate = float(min_rate)
+        self.recovery = float(recovery)
+        self._tokens = float(burst)
+        self._stamp = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a token is available"""
+        time.sleep(self.reserve())
+
+    def reserve(self):
+        """Take a token and return how long the caller has to wait before using it"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + ((now - self._stamp) * self.rate))
+            self._stamp = now
+            self._tokens = self._tokens - 1
+            if self._tokens >= 0:
+                return 0
+            return -self._tokens / self.rate
+
+    def throttled(self):
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            # Drop the saved up burst, the server just told us to slow down
+            self._tokens = min(self._tokens, 0)
+        self._LOG.info("Throttled, request rate lowered to %.2f/s" % self.rate)
+
+    def succeeded(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.recovery)
+
+class RetryPolicy(object):
+    """Exponential backoff with full jitter, a Retry-After header from the server takes precedence"""
+
+    RETRY_STATUS = (429, 500, 502, 503, 504)
+    # A throttled request was not carried out, a server error after a write may have been
+    THROTTLED_STATUS = 429
+
+    def __init__(self, retries=5, base_delay=1.0, max_delay=60.0):
+        self.retries = retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def should_retry(self, status, attempt, idempotent=True):
+        """Requests that are not idempotent are only retried when throttled, a repeat could apply them twice"""
+        if not idempotent and status != RetryPolicy.THROTTLED_STATUS:
+            return False
+        return status in RetryPolicy.RETRY_STATUS and attempt < self.retries
+
+    def delay(self, attempt, retry_after=None):
+        seconds = RetryPolicy._parse_retry_after(retry_after)
+        if seconds is not None:
+            return min(self.max_delay, seconds)
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    @staticmethod
+    def _parse_retry_after(value):
+        # Either a number of seconds or an http date
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+        except (TypeError, ValueError):
+            return None
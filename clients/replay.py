@@ -0,0 +1,188 @@
+import base64
+import hashlib
+import json
+import logging
+import os
+import threading
+
+from datetime import date, timedelta
+from urllib.parse import urlsplit
+
+import requests
+
+from requests.adapters import BaseAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+class ReplayMissError(requests.exceptions.ConnectionError):
+    """A request the cassette has no recorded response for, it would have gone to the network"""
+
+class HttpCassette(object):
+    """
+    The http requests of a session and their responses, saved to a json fixture.
+    Recorded requests are matched on method, path and query, the host is left out so a session
+    recorded against one server replays for another. Requests with the same path are answered in
+    recorded order, preferring the response recorded for the same body. A request without a
+    recorded response fails with ReplayMissError instead of going to the network.
+    """
+
+    _VERSION = 1
+
+    # Left out of the fixture: credentials, and the headers of the wire encoding, the body is saved decoded
+    _DROPPED_HEADERS = frozenset(("set-cookie", "content-encoding", "content-length", "transfer-encoding", "connection", "keep-alive"))
+
+    _LOG = logging.getLogger(__name__)
+
+    def __init__(self, path, interactions=(), today=None, replaying=False):
+        self.path = path
+        self.today = today or date.today()
+        self.replaying = replaying
+        self.interactions = list(interactions)
+        self.played = 0
+        self.misses = []
+        self._lock = threading.Lock()
+        self._unplayed = {}
+        for interaction in self.interactions:
+            self._unplayed.setdefault(HttpCassette._key(interaction["method"], interaction["url"]), []).append(interaction)
+
+    @staticmethod
+    def load(path):
+        """Cassette that replays the fixture at 'path'"""
+        with open(path, encoding="utf-8") as f:
+            fixture = json.load(f)
+        if fixture.get("version") != HttpCassette._VERSION:
+            raise ValueError("Fixture '%s' has version %s, expected %d" % (path, fixture.get("version"), HttpCassette._VERSION))
+        return HttpCassette(path, fixture["interactions"], date.fromisoformat(fixture["today"]), replaying=True)
+
+    def session(self):
+        return CassetteSession(self)
+
+    def save(self):
+        if self.replaying:
+            return
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        with self._lock:
+            fixture = {"version": HttpCassette._VERSION, "today": self.today.isoformat(), "interactions": self.interactions}
+            with open(self.path, "w", encoding="utf-8") as f:
+                json.dump(fixture, f, indent=1, sort_keys=True)
+                f.write("\n")
+        HttpCassette._LOG.info("Recorded %d requests to '%s'" % (len(self.interactions), self.path))
+
+    def record(self, request, response):
+        interaction = {
+            "method": request.method,
+            "url": HttpCassette._path(request.url),
+            "body_sha256": HttpCassette._digest(request.body),
+            "status": response.status_code,
+            "reason": response.reason,
+            "headers": {k: v for k, v in response.headers.items() if k.lower() not in HttpCassette._DROPPED_HEADERS},
+        }
+        content = response.content
+        try:
+            interaction["text"] = content.decode("utf-8")
+        except UnicodeDecodeError:
+            interaction["base64"] = base64.b64encode(content).decode("ascii")
+        with self._lock:
+            self.interactions.append(interaction)
+
+    def play(self, request):
+        """The recorded interaction for the request, ReplayMissError when there is none left"""
+        key = HttpCassette._key(request.method, request.url)
+        digest = HttpCassette._digest(request.body)
+        with self._lock:
+            candidates = self._unplayed.get(key)
+            if not candidates:
+                self.misses.append(key)
+                raise ReplayMissError("No recorded response for %s %s in '%s'" % (key + (self.path,)), request=request)
+            index = next((i for i, c in enumerate(candidates) if c["body_sha256"] == digest), 0)
+            self.played = self.played + 1
+            return candidates.pop(index)
+
+    def unplayed(self):
+        """(method, url) of the recorded requests that were not made"""
+        with self._lock:
+            return [key for key, candidates in self._unplayed.items() for _ in candidates]
+
+    @staticmethod
+    def content(interaction):
+        if "base64" in interaction:
+            return base64.b64decode(interaction["base64"])
+        return interaction["text"].encode("utf-8")
+
+    @staticmethod
+    def _key(method, url):
+        return method.upper(), HttpCassette._path(url)
+
+    @staticmethod
+    def _path(url):
+        parts = urlsplit(url)
+        return parts.path + ("?" + parts.query if parts.query else "")
+
+    @staticmethod
+    def _digest(body):
+        if body is None:
+            return None
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        elif not isinstance(body, bytes):
+            # A streamed upload, read once by the real adapter
+            return None
+        return hashlib.sha256(body).hexdigest()
+
+class CassetteSession(requests.Session):
+    """
+    Session that records every response into the cassette, or answers from it when it replays.
+    The cassette is consulted whatever adapter is mounted, garth mounts its own on configure.
+    """
+
+    def __init__(self, cassette):
+        requests.Session.__init__(self)
+        self.cassette = cassette
+        self._replay_adapter = ReplayAdapter(cassette)
+
+    def get_adapter(self, url):
+        if self.cassette.replaying:
+            return self._replay_adapter
+        return RecordingAdapter(requests.Session.get_adapter(self, url), self.cassette)
+
+class RecordingAdapter(BaseAdapter):
+
+    def __init__(self, adapter, cassette):
+        BaseAdapter.__init__(self)
+        self.adapter = adapter
+        self.cassette = cassette
+
+    def send(self, request, **kwargs):
+        response = self.adapter.send(request, **kwargs)
+        self.cassette.record(request, response)
+        return response
+
+    def close(self):
+        self.adapter.close()
+
+class ReplayAdapter(BaseAdapter):
+
+    def __init__(self, cassette):
+        BaseAdapter.__init__(self)
+        self.cassette = cassette
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        interaction = self.cassette.play(request)
+
+        response = requests.Response()
+        response.status_code = interaction["status"]
+        response.reason = interaction["reason"]
+        response.headers = CaseInsensitiveDict(interaction["headers"])
+        response.encoding = get_encoding_from_headers(response.headers)
+        response._content = HttpCassette.content(interaction)
+        response._content_consumed = True
+        response.url = request.url
+        response.request = request
+        response.connection = self
+        response.elapsed = timedelta(0)
+        return response
+
+    def close(self):
+        pass
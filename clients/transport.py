@@ -0,0 +1,66 @@
+import importlib.util
+import logging
+
+import requests
+
+from requests.adapters import HTTPAdapter
+
+class HttpTransport(object):
+    """
+    One keep-alive requests session shared by the garmin and the calendar client.
+    The connection pool is sized for the number of concurrent requests, so parallel
+    work reuses open connections instead of waiting for a new TLS handshake.
+    """
+
+    _LOG = logging.getLogger(__name__)
+
+    # Seconds to connect and seconds between bytes of the response
+    CONNECT_TIMEOUT = 5.0
+    READ_TIMEOUT = 30.0
+
+    def __init__(self, pool_size=10, connect_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT, retries=2, session=None):
+        """
+        'retries' only covers failed connections, responses are retried by Garmin._call.
+        'session' replaces the plain requests session, e.g. a CassetteSession that records or replays.
+        """
+        self.pool_size = pool_size
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+
+        self.session = session if session is not None else requests.Session()
+        self.session.headers["Accept-Encoding"] = HttpTransport.accept_encoding()
+        adapter = self._adapter()
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    @staticmethod
+    def accept_encoding():
+        # urllib3 only decodes brotli when one of the brotli packages is installed
+        if importlib.util.find_spec("brotli") or importlib.util.find_spec("brotlicffi"):
+            return "gzip, deflate, br"
+        return "gzip, deflate"
+
+    def _adapter(self):
+        return HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size, max_retries=self.retries)
+
+    def get(self, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        return self.session.get(url, **kwargs)
+
+    def garth_options(self):
+        """Options for garth.Client.configure, garth mounts its own adapter on the session"""
+        return {
+            "timeout": self.timeout,
+            "retries": self.retries,
+            "pool_connections": self.pool_size,
+            "pool_maxsize": self.pool_size,
+        }
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
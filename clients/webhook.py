@@ -0,0 +1,99 @@
+import json
+import logging
+import re
+import threading
+import time
+
+from urllib.parse import parse_qs, unquote, urlparse
+
+class SyncTrigger(object):
+    """
+    Debounced calendar change notifications. A calendar is due once its notifications went quiet for
+    'debounce' seconds, or at the latest 'max_delay' seconds after the first one, so a burst of ten
+    edits gives one sync.
+    """
+
+    _LOG = logging.getLogger(__name__)
+
+    def __init__(self, debounce=2.0, max_delay=30.0):
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.received = 0
+        self._pending = {}
+        self._closed = False
+        self._condition = threading.Condition()
+
+    def notify(self, calendar_id):
+        now = time.monotonic()
+        with self._condition:
+            first = self._pending.get(calendar_id, (now, now))[0]
+            self._pending[calendar_id] = (first, now)
+            self.received = self.received + 1
+            self._condition.notify_all()
+
+    def wait(self, timeout):
+        """Block till calendars are due or 'timeout' passed, returns the due calendar ids"""
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                due = [c for c, (first, last) in self._pending.items()
+                       if now - last >= self.debounce or now - first >= self.max_delay]
+                if due:
+                    for c in due:
+                        del self._pending[c]
+                    return due
+                if self._closed or now >= deadline:
+                    return []
+
+                wake = deadline
+                for first, last in self._pending.values():
+                    wake = min(wake, last + self.debounce, first + self.max_delay)
+                self._condition.wait(max(0.0, wake - now))
+
+    def close(self):
+        """Wake up wait, for a shutdown"""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+class WebhookRequest(object):
+    """The calendar id of a change notification, a Google Calendar push or a generic post"""
+
+    # Initial message of a new push channel, not a change
+    _GOOGLE_SYNC_STATE = "sync"
+    _GOOGLE_CALENDAR_SUFFIX = "@group.calendar.google.com"
+    _GOOGLE_RESOURCE = re.compile(r"/calendars/([^/]+)/events")
+
+    @staticmethod
+    def calendar_id(path, headers, body):
+        """Calendar id of the notification, '' for a notification without a change, None when it is not understood"""
+        state = headers.get("X-Goog-Resource-State")
+        if state is not None:
+            if state == WebhookRequest._GOOGLE_SYNC_STATE:
+                return ""
+            match = WebhookRequest._GOOGLE_RESOURCE.search(unquote(headers.get("X-Goog-Resource-URI", "")))
+            if match is None:
+                return None
+            return WebhookRequest._short_id(match.group(1))
+
+        query = parse_qs(urlparse(path).query)
+        if "calendar" in query:
+            return WebhookRequest._short_id(query["calendar"][0])
+        try:
+            payload = json.loads(body or b"{}")
+        except ValueError:
+            return None
+        calendar = payload.get("calendar") if isinstance(payload, dict) else None
+        return WebhookRequest._short_id(calendar) if calendar else None
+
+    @staticmethod
+    def token(headers):
+        return headers.get("X-Goog-Channel-Token") or headers.get("X-Webhook-Token")
+
+    @staticmethod
+    def _short_id(calendar_id):
+        # The calendar commands take the id without the google domain
+        if calendar_id.endswith(WebhookRequest._GOOGLE_CALENDAR_SUFFIX):
+            return calendar_id[:-len(WebhookRequest._GOOGLE_CALENDAR_SUFFIX)]
+        return calendar_id
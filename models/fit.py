@@ -0,0 +1,227 @@
+import os
+import re
+import struct
+import time
+import zlib
+
+class FitWorkoutEncoder(object):
+    """Encodes a workout as a FIT workout file, the format a watch reads from GARMIN/NewFiles"""
+
+    _NEW_FILES_DIR = os.path.join("GARMIN", "NewFiles")
+
+    # Seconds between the unix epoch and the FIT epoch (1989-12-31 00:00:00 UTC)
+    _FIT_EPOCH_OFFSET = 631065600
+
+    _PROTOCOL_VERSION = 0x20
+    _PROFILE_VERSION = 2132
+
+    _NAME_SIZE = 32
+    _NOTES_SIZE = 64
+
+    # Base types
+    _ENUM = 0x00
+    _UINT16 = 0x84
+    _UINT32 = 0x86
+    _UINT32Z = 0x8C
+    _STRING = 0x07
+
+    _INVALID_ENUM = 0xFF
+    _INVALID_UINT32 = 0xFFFFFFFF
+
+    # Global message numbers
+    _MESG_FILE_ID = 0
+    _MESG_WORKOUT = 26
+    _MESG_WORKOUT_STEP = 27
+
+    _FILE_TYPE_WORKOUT = 5
+    _MANUFACTURER_DEVELOPMENT = 255
+    _SPORT_RUNNING = 1
+
+    _DURATION_TIME = 0
+    _DURATION_DISTANCE = 1
+    _DURATION_OPEN = 5
+    _DURATION_REPEAT_UNTIL_STEPS_CMPLT = 6
+
+    _TARGET_SPEED = 0
+    _TARGET_HEART_RATE = 1
+    _TARGET_OPEN = 2
+
+    # Custom heart rate targets are offset by 100, values below are zones
+    _HEART_RATE_OFFSET = 100
+
+    _INTENSITY_ACTIVE = 0
+    _INTENSITY_WARMUP = 2
+    _INTENSITY_COOLDOWN = 3
+    _INTENSITY_RECOVERY = 4
+
+    _HEADER = struct.Struct("<BBHI4sH")
+    _CRC = struct.Struct("<H")
+
+    # Record layouts, the field order matches the definitions below
+    _FILE_ID = struct.Struct("<BBHHII")
+    _WORKOUT = struct.Struct("<B%dsBH" % _NAME_SIZE)
+    _WORKOUT_STEP = struct.Struct("<BHBIBIIIB%ds" % _NOTES_SIZE)
+
+    _CRC_TABLE = (
+        0x0000, 0xCC01, 0xD801, 0x1400, 0xF001, 0x3C00, 0x2800, 0xE401,
+        0xA001, 0x6C00, 0x7800, 0xB401, 0x5000, 0x9C01, 0x8801, 0x4400
+    )
+
+    @staticmethod
+    def _definition(local_type, global_number, fields):
+        record = struct.pack("<BBBHB", 0x40 | local_type, 0, 0, global_number, len(fields))
+        for f in fields:
+            record = record + struct.pack("<BBB", *f)
+        return record
+
+    def __init__(self):
+        cls = FitWorkoutEncoder
+        self._definitions = (
+            cls._definition(0, cls._MESG_FILE_ID, [
+                (0, 1, cls._ENUM),       # type
+                (1, 2, cls._UINT16),     # manufacturer
+                (2, 2, cls._UINT16),     # product
+                (3, 4, cls._UINT32Z),    # serial_number
+                (4, 4, cls._UINT32),     # time_created
+            ])
+            + cls._definition(1, cls._MESG_WORKOUT, [
+                (8, cls._NAME_SIZE, cls._STRING),    # wkt_name
+                (4, 1, cls._ENUM),                   # sport
+                (6, 2, cls._UINT16),                 # num_valid_steps
+            ])
+            + cls._definition(2, cls._MESG_WORKOUT_STEP, [
+                (254, 2, cls._UINT16),   # message_index
+                (1, 1, cls._ENUM),       # duration_type
+                (2, 4, cls._UINT32),     # duration_value
+                (3, 1, cls._ENUM),       # target_type
+                (4, 4, cls._UINT32),     # target_value
+                (5, 4, cls._UINT32),     # custom_target_value_low
+                (6, 4, cls._UINT32),     # custom_target_value_high
+                (7, 1, cls._ENUM),       # intensity
+                (8, cls._NOTES_SIZE, cls._STRING),   # notes
+            ])
+        )
+
+    def encode(self, workout, name=None):
+        """Return the FIT file content for the workout"""
+        name = workout.get_workout_name() if name is None else name
+        steps = workout.compile_steps()
+        num_steps = self._count_steps(steps)
+
+        data_size = (len(self._definitions) + self._FILE_ID.size + self._WORKOUT.size
+            + (num_steps * self._WORKOUT_STEP.size))
+        buffer = bytearray(self._HEADER.size + data_size + self._CRC.size)
+
+        offset = self._HEADER.size
+        buffer[offset:offset + len(self._definitions)] = self._definitions
+        offset = offset + len(self._definitions)
+
+        self._FILE_ID.pack_into(buffer, offset, 0,
+            self._FILE_TYPE_WORKOUT, self._MANUFACTURER_DEVELOPMENT, 0,
+            zlib.crc32(name.encode("utf-8")) or 1,
+            int(time.time()) - self._FIT_EPOCH_OFFSET)
+        offset = offset + self._FILE_ID.size
+
+        self._WORKOUT.pack_into(buffer, offset, 1,
+            self._string(name, self._NAME_SIZE), self._SPORT_RUNNING, num_steps)
+        self._pack_steps(buffer, steps, 0)
+
+        self._HEADER.pack_into(buffer, 0, self._HEADER.size, self._PROTOCOL_VERSION,
+            self._PROFILE_VERSION, data_size, b".FIT", self._crc(buffer, 0, self._HEADER.size - 2))
+        self._CRC.pack_into(buffer, len(buffer) - self._CRC.size, self._crc(buffer, 0, len(buffer) - self._CRC.size))
+
+        return bytes(buffer)
+
+    def write(self, workout, directory, name=None):
+        """Write the workout into the directory. A mounted watch root is resolved to its GARMIN/NewFiles"""
+        name = workout.get_workout_name() if name is None else name
+        new_files = os.path.join(directory, self._NEW_FILES_DIR)
+        if os.path.isdir(new_files):
+            directory = new_files
+
+        filename = os.path.join(directory, FitWorkoutEncoder.filename(name))
+        with open(filename, "wb") as f:
+            f.write(self.encode(workout, name))
+
+        return filename
+
+    @staticmethod
+    def filename(name):
+        return re.sub(r"[^A-Za-z0-9_-]+", "_", name).strip("_")[:40] + ".fit"
+
+    def _count_steps(self, steps):
+        n = 0
+        for s in steps:
+            if s.is_repeat():
+                n = n + self._count_steps(s.get_repeat_steps())
+            n = n + 1
+        return n
+
+    def _pack_steps(self, buffer, steps, offset_index):
+        # FIT lists the repeated steps first, followed by a step pointing back to the first of them
+        base = self._HEADER.size + len(self._definitions) + self._FILE_ID.size + self._WORKOUT.size
+        for s in steps:
+            if s.is_repeat():
+                first_index = offset_index
+                offset_index = self._pack_steps(buffer, s.get_repeat_steps(), offset_index)
+                self._WORKOUT_STEP.pack_into(buffer, base + (offset_index * self._WORKOUT_STEP.size), 2,
+                    offset_index, self._DURATION_REPEAT_UNTIL_STEPS_CMPLT, first_index,
+                    self._INVALID_ENUM, s.get_repeat_iterations(), self._INVALID_UINT32, self._INVALID_UINT32,
+                    self._INVALID_ENUM, b"")
+            else:
+                self._pack_step(buffer, base + (offset_index * self._WORKOUT_STEP.size), offset_index, s)
+            offset_index = offset_index + 1
+
+        return offset_index
+
+    def _pack_step(self, buffer, offset, message_index, s):
+        duration_type = self._DURATION_OPEN
+        duration_value = self._INVALID_UINT32
+        if s.get_end_distance() is not None:
+            duration_type = self._DURATION_DISTANCE
+            duration_value = s.get_end_distance() * 100
+        elif s.get_end_time() is not None:
+            duration_type = self._DURATION_TIME
+            duration_value = s.get_end_time() * 1000
+
+        target_type = self._TARGET_OPEN
+        low = high = self._INVALID_UINT32
+        if s.get_target_bpm() is not None:
+            target_type = self._TARGET_HEART_RATE
+            low, high = [v + self._HEART_RATE_OFFSET for v in s.get_target_bpm()]
+        elif s.get_target_speed() is not None:
+            target_type = self._TARGET_SPEED
+            fast, slow = s.get_target_speed()
+            low, high = int(round(slow * 1000)), int(round(fast * 1000))
+
+        self._WORKOUT_STEP.pack_into(buffer, offset, 2,
+            message_index, duration_type, duration_value,
+            target_type, 0, low, high,
+            self._intensity(s), self._string(s.get_description(), self._NOTES_SIZE))
+
+    def _intensity(self, s):
+        if s.is_warmup():
+            return self._INTENSITY_WARMUP
+        if s.is_cooldown():
+            return self._INTENSITY_COOLDOWN
+        if s.is_recovery():
+            return self._INTENSITY_RECOVERY
+        return self._INTENSITY_ACTIVE
+
+    def _string(self, value, size):
+        # Null terminated, truncated on a character boundary
+        value = value.encode("utf-8")[:size - 1]
+        return value.decode("utf-8", "ignore").encode("utf-8")
+
+    def _crc(self, buffer, start, end):
+        crc = 0
+        table = self._CRC_TABLE
+        for i in range(start, end):
+            byte = buffer[i]
+            tmp = table[crc & 0xF]
+            crc = (crc >> 4) & 0x0FFF
+            crc = crc ^ tmp ^ table[byte & 0xF]
+            tmp = table[crc & 0xF]
+            crc = (crc >> 4) & 0x0FFF
+            crc = crc ^ tmp ^ table[(byte >> 4) & 0xF]
+        return crc
@@ -0,0 +1,49 @@
+import json
+
+class Payload(object):
+
+    _SEPARATORS = (",", ":")
+
+    _HASH_LENGTH = 16
+
+    # orjson module, False when it is not installed. Imported on the first dumps, dry only hashes
+    _orjson = None
+
+    @staticmethod
+    def compact(value):
+        # Drop the None values recursively, garmin fills them in itself
+        if isinstance(value, dict):
+            return { k: Payload.compact(v) for k, v in value.items() if v is not None }
+        if isinstance(value, (list, tuple)):
+            return [ Payload.compact(v) for v in value if v is not None ]
+        return value
+
+    @staticmethod
+    def dumps(value):
+        """Serialize to the canonical form: no nulls, sorted keys, compact separators, utf-8 bytes"""
+        value = Payload.compact(value)
+        orjson = Payload._backend()
+        if orjson:
+            return orjson.dumps(value, option=orjson.OPT_SORT_KEYS)
+
+        return Payload._stdlib_dumps(value)
+
+    @staticmethod
+    def digest(value):
+        """Stable content hash of the canonical form. Always uses the stdlib encoder so the hash does not depend on the backend"""
+        import hashlib
+        return hashlib.sha256(Payload._stdlib_dumps(Payload.compact(value))).hexdigest()[:Payload._HASH_LENGTH]
+
+    @staticmethod
+    def _backend():
+        if Payload._orjson is None:
+            try:
+                import orjson
+                Payload._orjson = orjson
+            except ImportError:
+                Payload._orjson = False
+        return Payload._orjson
+
+    @staticmethod
+    def _stdlib_dumps(value):
+        return json.dumps(value, sort_keys=True, separators=Payload._SEPARATORS, ensure_ascii=False).encode("utf-8")
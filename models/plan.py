@@ -0,0 +1,113 @@
+import logging
+
+from models.workout import Workout
+
+class SyncPlan(object):
+    """
+    The changes that bring Garmin Connect in line with the calendar. Calendar events and synced
+    workouts are joined on the identity marker with set operations: new events are created, changed
+    ones updated in place, moved ones rescheduled and workouts without an event deleted.
+    """
+
+    __slots__ = ("creates", "updates", "schedules", "unschedules", "deletes", "unchanged")
+
+    _NAME_PREFIX = "T | "
+
+    _LOG = logging.getLogger(__name__)
+
+    def __init__(self):
+        # (event key, workout json, date) of the workouts to upload and schedule
+        self.creates = []
+        # (workout id, workout json) of the workouts to replace
+        self.updates = []
+        # (workout id, date)
+        self.schedules = []
+        # (workout id, schedule id, date) of schedules on dates the event is not on anymore
+        self.unschedules = []
+        # (workout id, workout name)
+        self.deletes = []
+        # (workout id, date) of the workouts that are in sync
+        self.unchanged = []
+
+    @staticmethod
+    def workout_name(title):
+        return SyncPlan._NAME_PREFIX + title
+
+    @staticmethod
+    def build(cal_items, workouts, schedule):
+        """Plan from the calendar items, the workout summaries of Garmin Connect and the Schedule of the window"""
+        plan = SyncPlan()
+
+        cal_items = list(cal_items)
+        uids = {}
+        for cal_item in cal_items:
+            uids[cal_item.uid] = uids.get(cal_item.uid, 0) + 1
+
+        desired = {}
+        for cal_item in cal_items:
+            day = cal_item.get_dt_start()
+            # The instances of a recurring event share the uid, the date tells them apart. An event with
+            # a uid of its own keeps the uid key, so moving it reschedules its workout.
+            key = Workout.uid_key(cal_item.uid, day if uids[cal_item.uid] > 1 else None)
+            if key in desired:
+                SyncPlan._LOG.warning("Calendar event %s is on %s twice, only the last one '%s' is synced" % (cal_item.uid, day, cal_item.title))
+            w = Workout(cal_item.title, cal_item.description)
+            payload = w.create_workout(SyncPlan.workout_name(w.get_workout_name()))
+            digest = Workout.add_marker(payload, key)
+            desired[key] = (payload, digest, day)
+
+        existing = {}
+        for workout in workouts:
+            marker = Workout.extract_marker(workout)
+            if marker is None:
+                # Synced by the versions that put the uid in the name, they are replaced
+                if Workout.extract_workout_name(workout).startswith(SyncPlan._NAME_PREFIX):
+                    plan.deletes.append((Workout.extract_workout_id(workout), Workout.extract_workout_name(workout)))
+                continue
+            if marker[0] in existing:
+                # The same event synced twice, keep one
+                plan.deletes.append((Workout.extract_workout_id(workout), Workout.extract_workout_name(workout)))
+                continue
+            existing[marker[0]] = (workout, marker[1])
+
+        for key in desired.keys() - existing.keys():
+            payload, digest, day = desired[key]
+            plan.creates.append((key, payload, day))
+
+        for key in existing.keys() - desired.keys():
+            workout = existing[key][0]
+            plan.deletes.append((Workout.extract_workout_id(workout), Workout.extract_workout_name(workout)))
+
+        for key in desired.keys() & existing.keys():
+            payload, digest, day = desired[key]
+            workout, existing_digest = existing[key]
+            wid = Workout.extract_workout_id(workout)
+
+            changed = digest != existing_digest
+            if changed:
+                payload[Workout._WORKOUT_ID_FIELD] = wid
+                payload[Workout._WORKOUT_OWNER_ID_FIELD] = workout.get(Workout._WORKOUT_OWNER_ID_FIELD)
+                plan.updates.append((wid, payload))
+
+            dates = schedule.dates(wid)
+            if day not in dates:
+                plan.schedules.append((wid, day))
+            for other in dates - {day}:
+                s_item = schedule.item(wid, other)
+                plan.unschedules.append((wid, s_item.schedule_id, other))
+            if not changed and dates == {day}:
+                plan.unchanged.append((wid, day))
+
+        # Deterministic order, the set operations are not
+        plan.creates.sort(key=lambda c: (c[2], c[0]))
+        for changes in (plan.updates, plan.schedules, plan.unschedules, plan.deletes, plan.unchanged):
+            changes.sort(key=lambda c: str(c[0]))
+        return plan
+
+    def __len__(self):
+        """Number of changes"""
+        return len(self.creates) + len(self.updates) + len(self.schedules) + len(self.unschedules) + len(self.deletes)
+
+    def summary(self):
+        return "%d to create, %d to update, %d to schedule, %d to unschedule, %d to delete and %d in sync" % (
+            len(self.creates), len(self.updates), len(self.schedules), len(self.unschedules), len(self.deletes), len(self.unchanged))
@@ -3,9 +3,68 @@ import json
 from datetime import datetime, date
 
 class Schedule(object):
+    """
+    Index of the scheduled workouts in one or more calendar-service month responses.
+    Answers on which dates a workout is scheduled and which workouts are on a date, both without a scan.
+    """
+
+    __slots__ = ("_items", "_dates_by_workout", "_items_by_date")
 
     _SCHEDULE_ITEMS = "calendarItems"
-    
+
+    def __init__(self, months=()):
+        self._items = {}
+        self._dates_by_workout = {}
+        self._items_by_date = {}
+        for month in months:
+            self.add_month(month)
+
+    def add_month(self, json):
+        """Add the workouts of a month response, items already added through an overlapping month are skipped"""
+        for i in json[Schedule._SCHEDULE_ITEMS]:
+            if str(i.get(ScheduleItem._SCHEDULE_TYPE_FIELD)).lower() != "workout":
+                continue
+            s_item = ScheduleItem(i)
+            key = s_item.schedule_id if s_item.schedule_id is not None else (s_item.workout_id, s_item.date)
+            if key in self._items:
+                continue
+            self._items[key] = s_item
+            self._dates_by_workout.setdefault(s_item.workout_id, set()).add(s_item.date)
+            self._items_by_date.setdefault(s_item.date, []).append(s_item)
+
+    def dates(self, workout_id):
+        """Dates (YYYY-MM-DD) the workout is scheduled on, empty when it is not scheduled"""
+        return self._dates_by_workout.get(workout_id, frozenset())
+
+    def on_date(self, day):
+        """Schedule items on the date (YYYY-MM-DD)"""
+        return self._items_by_date.get(day, [])
+
+    def item(self, workout_id, day):
+        for s_item in self.on_date(day):
+            if s_item.workout_id == workout_id:
+                return s_item
+        return None
+
+    def __contains__(self, workout_id):
+        return workout_id in self._dates_by_workout
+
+    def __iter__(self):
+        return iter(self._items.values())
+
+    def __len__(self):
+        return len(self._items)
+
+    @staticmethod
+    def months(start, end):
+        """(year, month) of the months from date 'start' till 'end', the month zero based like the calendar service"""
+        months = []
+        year, month = start.year, start.month
+        while (year, month) <= (end.year, end.month):
+            months.append((year, month - 1))
+            year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+        return months
+
     @staticmethod
     def items(json):
         for i in json[Schedule._SCHEDULE_ITEMS]:
@@ -15,18 +74,24 @@ class Schedule(object):
 
 class ScheduleItem(object):
 
+    __slots__ = ("item", "schedule_id", "workout_id", "date")
+
+    _SCHEDULE_ID_FIELD = "id"
     _SCHEDULE_TYPE_FIELD = "itemType"
     _SCHEDULE_WORKOUT_FIELD = "workoutId"
     _SCHEDULE_DATE_FIELD = "date"
 
     def __init__(self, item):
         self.item = item
+        self.schedule_id = item.get(ScheduleItem._SCHEDULE_ID_FIELD)
+        self.workout_id = item.get(ScheduleItem._SCHEDULE_WORKOUT_FIELD)
+        self.date = item.get(ScheduleItem._SCHEDULE_DATE_FIELD)
 
     def is_workout(self):
         return str(self.item[ScheduleItem._SCHEDULE_TYPE_FIELD]).lower() == "workout"
 
     def extract_item_workout(self):
-        return self.item[ScheduleItem._SCHEDULE_WORKOUT_FIELD]
+        return self.workout_id
 
     def extract_item_date(self):
-        return self.item[ScheduleItem._SCHEDULE_DATE_FIELD]
\ No newline at end of file
+        return self.date
@@ -1,12 +1,43 @@
 import re
-import json
 
 class Step(object):
 
+    __slots__ = (
+        "order", "type", "description", "repeat_list",
+        "end_condition", "end_amount", "step_repeat", "step_repeat_iterations",
+        "target", "target_low", "target_high",
+        "est_dst", "est_dur"
+    )
+
     _DEFAULT_PACE = "05:35"
 
     _REGEX = re.compile("^\* (w|s|r|c|x)(?:(?:(?: ([0-9]+?|[0-9]{2}:[0-9]{2})(k|m|t))|(?: ([1-9]) ([1-9][0-9]{0,1})))(?: @(?:([0-9]{2,3}-[0-9]{2,3})|([0-9]{2}:[0-9]{2})))?)?")
 
+    # Compact step, end condition and target types. They index the shared json constants below
+    _STEP_INTERVAL = 0
+    _STEP_WARMUP = 1
+    _STEP_COOLDOWN = 2
+    _STEP_RECOVERY = 3
+    _STEP_REPEAT = 4
+
+    _END_LAPBUTTON = 0
+    _END_TIME = 1
+    _END_DISTANCE = 2
+
+    _TARGET_NONE = 0
+    _TARGET_HR = 1
+    _TARGET_PACE = 2
+
+    _STEP_TYPES_BY_CODE = {
+        "s": _STEP_INTERVAL,
+        "w": _STEP_WARMUP,
+        "c": _STEP_COOLDOWN,
+        "r": _STEP_RECOVERY,
+        "x": _STEP_REPEAT,
+    }
+
+    _NO_STEPS = ()
+
     _WARMUP_STEP_TYPE = {
         "stepTypeId": 1,
         "stepTypeKey": "warmup",
@@ -62,19 +93,47 @@ class Step(object):
         "workoutTargetTypeKey": "pace.zone"
     }
 
+    _STEP_TYPES = (_INTERVAL_STEP_TYPE, _WARMUP_STEP_TYPE, _COOLDOWN_STEP_TYPE, _RECOVERY_STEP_TYPE, _REPEAT_STEP_TYPE)
+    _CONDITIONS = (_CONDITION_LAPBUTTON, _CONDITION_TIME, _CONDITION_DISTANCE)
+    _TARGETS = (_TARGET_NOTARGET_TYPE, _TARGET_HR_TYPE, _TARGET_PACE_TYPE)
+
     def __init__(self, order_n, groups):
-        # print(json.dumps(groups))
-        # print("---")
         self.order = order_n
-        self.type = groups[0]
+        self.type = Step._STEP_TYPES_BY_CODE[groups[0]]
         self.description = ""
-        self.repeat_list = []
-        self.end_value = groups[1]
-        self.end_type = groups[2]
+        self.repeat_list = Step._NO_STEPS
         self.step_repeat = groups[3]
         self.step_repeat_iterations = groups[4]
-        self.target_bpm = groups[5]
-        self.target_pace = groups[6]
+        self.est_dst = 0
+        self.est_dur = 0
+
+        # Resolve the end condition once, in meter or seconds
+        end_type = groups[2]
+        if end_type == "k":
+            self.end_condition = Step._END_DISTANCE
+            self.end_amount = int(groups[1]) * 1000
+        elif end_type == "m":
+            self.end_condition = Step._END_DISTANCE
+            self.end_amount = int(groups[1])
+        elif end_type == "t":
+            self.end_condition = Step._END_TIME
+            self.end_amount = self._strtime_to_seconds(groups[1])
+        else:
+            self.end_condition = Step._END_LAPBUTTON
+            self.end_amount = None
+
+        # Heart rate targets are kept in bpm, pace targets in seconds per km
+        if groups[5] is not None:
+            target_val = groups[5].split("-")
+            self.target = Step._TARGET_HR
+            self.target_low = int(target_val[0])
+            self.target_high = int(target_val[1])
+        elif groups[6] is not None:
+            self.target = Step._TARGET_PACE
+            self.target_low = self.target_high = self._strtime_to_seconds(groups[6])
+        else:
+            self.target = Step._TARGET_NONE
+            self.target_low = self.target_high = None
 
     def create_step_json(self, child_step_id = None):
         if self.is_repeat():
@@ -84,6 +143,8 @@ class Step(object):
         return self._interval_step(child_step_id)
 
     def add_repeat_step(self, step):
+        if self.repeat_list is Step._NO_STEPS:
+            self.repeat_list = []
         self.repeat_list.append(step)
 
     def generate_distance(self):
@@ -92,18 +153,12 @@ class Step(object):
         if self.is_repeat():
             for s in self.repeat_list:
                 self.est_dst = self.est_dst + (s.generate_distance() * int(self.step_repeat_iterations))
-        else:
-            if self.end_type == "k":
-                self.est_dst = self._end_condition_value() * 1000
-            elif self.end_type == "m":
-                self.est_dst = self._end_condition_value()
-            elif self.end_type == "t":
-                time = self._end_condition_value_time()
-                # if self.target_pace is None:
-                #     self.target_pace = Step._DEFAULT_PACE
-                target_seconds = self._strtime_to_seconds(Step._DEFAULT_PACE)
-                self.est_dst = (time * 1000) / target_seconds
-        
+        elif self.end_condition == Step._END_DISTANCE:
+            self.est_dst = self.end_amount
+        elif self.end_condition == Step._END_TIME:
+            target_seconds = self._strtime_to_seconds(Step._DEFAULT_PACE)
+            self.est_dst = (self.end_amount * 1000) / target_seconds
+
         return self.est_dst
 
     def generate_duration(self):
@@ -112,19 +167,11 @@ class Step(object):
         if self.is_repeat():
             for s in self.repeat_list:
                 self.est_dur = self.est_dur + (s.generate_duration() * int(self.step_repeat_iterations))
-        else:
-            if self.end_type == "k" or self.end_type == "m":
-                # if self.target_pace is None:
-                #     self.target_pace = Step._DEFAULT_PACE
-                target_seconds = self._strtime_to_seconds(Step._DEFAULT_PACE)
-
-                dst = self._end_condition_value()
-                if self.end_type == "k":
-                    dst = dst * 1000
-
-                self.est_dur = target_seconds * dst / 1000
-            elif self.end_type == "t":
-                self.est_dur = self._end_condition_value_time()
+        elif self.end_condition == Step._END_DISTANCE:
+            target_seconds = self._strtime_to_seconds(Step._DEFAULT_PACE)
+            self.est_dur = target_seconds * self.end_amount / 1000
+        elif self.end_condition == Step._END_TIME:
+            self.est_dur = self.end_amount
 
         return self.est_dur
 
@@ -136,12 +183,11 @@ class Step(object):
         # Do not include it on last step
         if n != total_steps:
             self.description = "%d / %d" % (n, total_steps)
-            if self.target_bpm is not None:
-                target_val = str(self.target_bpm).split("-")
-                avg_target = int((int(target_val[1]) + int(target_val[0])) / 2)
+            if self.target == Step._TARGET_HR:
+                avg_target = int((self.target_high + self.target_low) / 2)
                 self.description = self.description + " (%s)" % avg_target
-            elif self.target_pace is not None:
-                self.description = self.description + " (%s)" % self.target_pace
+            elif self.target == Step._TARGET_PACE:
+                self.description = self.description + " (%02d:%02d)" % divmod(self.target_low, 60)
 
         if self.is_repeat():
             n = 1
@@ -151,118 +197,97 @@ class Step(object):
                 r.set_step_description(total, n)
                 # Increment to number of repeat
                 n = n + 1
-    
+
     def is_warmup(self):
-        return self.type == "w"
+        return self.type == Step._STEP_WARMUP
 
     def is_recovery(self):
-        return self.type == "r"
+        return self.type == Step._STEP_RECOVERY
 
     def is_repeat(self):
-        return self.type == "x"
+        return self.type == Step._STEP_REPEAT
 
     def get_repeat_number(self):
         return int(self.step_repeat)
 
+    def get_repeat_iterations(self):
+        return int(self.step_repeat_iterations)
+
+    def get_repeat_steps(self):
+        return self.repeat_list
+
+    def get_end_distance(self):
+        # Distance in meter, None if the step does not end on a distance
+        if self.end_condition == Step._END_DISTANCE:
+            return self.end_amount
+        return None
+
+    def get_end_time(self):
+        # Time in seconds, None if the step does not end on a time
+        if self.end_condition == Step._END_TIME:
+            return self.end_amount
+        return None
+
+    def get_target_bpm(self):
+        if self.target != Step._TARGET_HR:
+            return None
+        return (self.target_low, self.target_high)
+
+    def get_target_speed(self):
+        # Speed range in m/s as (fast, slow)
+        if self.target != Step._TARGET_PACE:
+            return None
+        return (self._target_pace_one(self.target_low), self._target_pace_two(self.target_high))
+
+    def get_description(self):
+        return self.description
+
     def is_cooldown(self):
-        return self.type == "c"
+        return self.type == Step._STEP_COOLDOWN
 
     @staticmethod
     def create_step(step_data):
-        # print("%s %s" % (step_data[1], step_data[0]))
         g = Step._REGEX.match(step_data[0])
         if g and len(g.groups()) == 7:
             return Step(step_data[1], g.groups())
 
-        raise Exception("Invalid step syntax for line < %s >" % line)
+        raise Exception("Invalid step syntax for line < %s >" % step_data[0])
 
     def _interval_step(self, child_step_id = None):
-        so = {
+        # Build the step in one go, the nested type objects are the shared constants
+        if self.target == Step._TARGET_HR:
+            value1 = self.target_low
+            value2 = self.target_high
+        elif self.target == Step._TARGET_PACE:
+            value1 = self._target_pace_one(self.target_low)
+            value2 = self._target_pace_two(self.target_high)
+        else:
+            value1 = value2 = None
+
+        return {
             "type": "ExecutableStepDTO",
             "stepOrder": self.order,
-            "stepType": self._get_step_type(),
+            "stepType": Step._STEP_TYPES[self.type],
             "childStepId": child_step_id,
-            "description": self.description
+            "description": self.description,
+            "endCondition": Step._CONDITIONS[self.end_condition],
+            "endConditionValue": self.end_amount,
+            "targetType": Step._TARGETS[self.target],
+            "targetValueOne": value1,
+            "targetValueTwo": value2
         }
 
-        self._end_condition(so)
-        self._target_type(so)
-
-        return so
-
     def _repeat_step(self, child_step_id):
-        # Generate the repeat steps
-        repeatSteps = []
-        for rs in self.repeat_list:
-            repeatSteps.append(rs.create_step_json(child_step_id))
-
-        so = {
+        return {
             "type": "RepeatGroupDTO",
             "stepOrder": self.order,
-            "stepType": self._REPEAT_STEP_TYPE,
+            "stepType": Step._REPEAT_STEP_TYPE,
             "childStepId": child_step_id,
             "numberOfIterations": self.step_repeat_iterations,
             "smartRepeat": False,
-            "workoutSteps": repeatSteps
+            "workoutSteps": [rs.create_step_json(child_step_id) for rs in self.repeat_list]
         }
 
-        return so
-        
-    def _get_step_type(self):
-        if self.is_warmup():
-            return self._WARMUP_STEP_TYPE
-        if self.is_recovery():
-            return self._RECOVERY_STEP_TYPE
-        if self.is_cooldown():
-            return self._COOLDOWN_STEP_TYPE
-
-        return self._INTERVAL_STEP_TYPE
-
-    def _end_condition(self, step):
-        condition = value = None
-
-        if self.end_type == "k":
-            condition = self._CONDITION_DISTANCE
-            value = self._end_condition_value() * 1000
-        elif self.end_type == "m":
-            condition = self._CONDITION_DISTANCE
-            value = self._end_condition_value()
-        elif self.end_type == "t":
-            condition = self._CONDITION_TIME
-            value = self._end_condition_value_time()
-
-        if condition is None:
-            condition = self._CONDITION_LAPBUTTON
-
-        step["endCondition"] = condition
-        step["endConditionValue"] = value
-
-    def _end_condition_value(self):
-        return int(self.end_value)
-
-    def _end_condition_value_time(self):
-        return self._strtime_to_seconds(self.end_value)
-
-    def _target_type(self, step):
-        target = value1 = value2 = None
-
-        if self.target_bpm is not None:
-            target = self._TARGET_HR_TYPE
-            target_val = str(self.target_bpm).split("-")
-            value1 = int(target_val[0])
-            value2 = int(target_val[1])
-        elif self.target_pace is not None:
-            target = self._TARGET_PACE_TYPE
-            target_seconds = self._strtime_to_seconds(self.target_pace)
-            value1 = self._target_pace_one(target_seconds)
-            value2 = self._target_pace_two(target_seconds)
-        else:
-            target = self._TARGET_NOTARGET_TYPE
-                
-        step["targetType"] = target
-        step["targetValueOne"] = value1
-        step["targetValueTwo"] = value2
-
     def _target_pace_one(self, sec):
         # Target pace is in m/s
         return 1000 / (sec - 3)
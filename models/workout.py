@@ -1,5 +1,7 @@
 import json
+import re
 
+from models.payload import Payload
 from models.step import Step
 
 class Workout(object):
@@ -9,6 +11,11 @@ class Workout(object):
     _WORKOUT_DESCRIPTION_FIELD = "description"
     _WORKOUT_OWNER_ID_FIELD = "ownerId"
 
+    # Identity marker at the end of the description of a synced workout: the hash of the calendar
+    # event uid and the hash of the workout content, e.g. "[gcal 3f2a9c0d1b7e4a55 9d0e1f2a3b4c5d6e]"
+    _MARKER_FORMAT = "[gcal %s %s]"
+    _MARKER_REGEX = re.compile(r"\s*\[gcal ([0-9a-f]{16}) ([0-9a-f]{16})\]$")
+
     _RUNNING_SPORT_TYPE = {
         "sportTypeId": 1,
         "sportTypeKey": "running"
@@ -62,8 +69,39 @@ class Workout(object):
         return workout[Workout._WORKOUT_OWNER_ID_FIELD]
 
     @staticmethod
-    def print_workout_json(workout):
-        print(json.dumps(workout, indent=4))
+    def workout_hash(workout):
+        return Payload.digest(workout)
+
+    @staticmethod
+    def uid_key(uid, day=None):
+        """Short collision free key of a calendar event uid, and of the date of one instance of a recurring event"""
+        import hashlib
+        if day is not None:
+            uid = uid + "/" + day
+        return hashlib.sha256(uid.encode("utf-8")).hexdigest()[:16]
+
+    @staticmethod
+    def add_marker(workout, key):
+        """Tag the workout with the event key and the hash of its content, returns the content hash"""
+        digest = Workout.workout_hash(workout)
+        description = workout.get(Workout._WORKOUT_DESCRIPTION_FIELD) or ""
+        workout[Workout._WORKOUT_DESCRIPTION_FIELD] = (description + "\n" + Workout._MARKER_FORMAT % (key, digest)).lstrip("\n")
+        return digest
+
+    @staticmethod
+    def extract_marker(workout):
+        """(event key, content hash) of a synced workout, None for other workouts"""
+        match = Workout._MARKER_REGEX.search(workout.get(Workout._WORKOUT_DESCRIPTION_FIELD) or "")
+        if match is None:
+            return None
+        return match.group(1), match.group(2)
+
+    @staticmethod
+    def print_workout_json(workout, compact=False):
+        if compact:
+            print(Payload.dumps(workout).decode("utf-8"))
+        else:
+            print(json.dumps(Payload.compact(workout), indent=4))
 
     @staticmethod
     def print_workout_summary(w):
@@ -75,7 +113,8 @@ class Workout(object):
     def _generate_description(self):
         return self.content
 
-    def _steps(self):
+    def compile_steps(self):
+        """Parse the content into steps with the estimates and descriptions filled in"""
         steps = []
 
         # Create the step objects
@@ -103,9 +142,12 @@ class Workout(object):
         if first_step is not None:
             first_step.set_description("Workout distance is '%s km (%s min)'" % (workout_distance, workout_duration))
 
+        return steps
+
+    def _steps(self):
         # Generate the json. The create step json generates the description
         steps_generated = []
-        for s in steps:
+        for s in self.compile_steps():
             steps_generated.append(s.create_step_json())
 
         return steps_generated
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+
+# Checks the cold start of the dry command against an import time budget, exits with 1 when it is over
+#   python tools/bench_import.py [--budget-ms 30] [--runs 5]
+
+import argparse
+import os
+import re
+import subprocess
+import sys
+import time
+
+_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+# Modules the dry command must not pull in
+_FORBIDDEN = ("garth", "requests", "pydantic", "aiohttp", "sqlite3")
+
+_IMPORT_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+
+def import_times(command):
+    """Cumulative microseconds of the top level imports and the set of all imported modules"""
+    result = subprocess.run([sys.executable, "-X", "importtime"] + command, cwd=_ROOT,
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, check=True)
+
+    top_level = {}
+    modules = set()
+    for line in result.stderr.splitlines():
+        match = _IMPORT_LINE.match(line)
+        if match is None:
+            continue
+        modules.add(match.group(4))
+        # Nested imports are indented by two spaces per level
+        if len(match.group(3)) == 1:
+            top_level[match.group(4)] = int(match.group(2))
+    return top_level, modules
+
+def main():
+    parser = argparse.ArgumentParser(description="Import time budget of the dry command")
+    parser.add_argument("--budget-ms", type=float, default=30.0, help="Maximum total import time in milliseconds")
+    parser.add_argument("--runs", type=int, default=5, help="Number of runs, the fastest counts")
+    parser.add_argument("--workout", default="repeat_workout", help="Test workout passed to dry")
+    args = parser.parse_args()
+
+    command = ["app.py", "dry", "--name", args.workout]
+    # What the interpreter imports on its own, like site, is not counted
+    startup = set(import_times(["-c", "pass"])[0])
+
+    best = None
+    best_wall = None
+    for i in range(args.runs):
+        start = time.perf_counter()
+        top_level, modules = import_times(command)
+        top_level = { name: us for name, us in top_level.items() if name not in startup }
+        wall = time.perf_counter() - start
+        total = sum(top_level.values()) / 1000.0
+        if best is None or total < best[0]:
+            best = (total, top_level, modules)
+        best_wall = wall if best_wall is None else min(best_wall, wall)
+
+    total, top_level, modules = best
+    print("import time    %.1f ms (budget %.1f ms)" % (total, args.budget_ms))
+    print("process time   %.1f ms" % (best_wall * 1000.0))
+    for name, us in sorted(top_level.items(), key=lambda i: -i[1])[:10]:
+        print("  %-24s %.1f ms" % (name, us / 1000.0))
+
+    forbidden = sorted(m for m in modules if m.split(".")[0] in _FORBIDDEN)
+    if forbidden:
+        print("dry imports %s" % ", ".join(forbidden))
+    if forbidden or total > args.budget_ms:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+
+# Measures memory and allocations of parsing and generating a large workout
+#   python tools/bench_steps.py [--steps 100000]
+
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from models.workout import Workout
+
+_LINES = [
+    "* s 200m @04:30",
+    "* s 02:00t @140-150",
+    "* r 1k",
+    "* w 3k @130-140",
+    "* c",
+]
+
+def workout_content(n):
+    return "\n".join(_LINES[i % len(_LINES)] for i in range(n))
+
+def main():
+    parser = argparse.ArgumentParser(description="Step memory benchmark")
+    parser.add_argument("--steps", type=int, default=100000, help="Number of steps in the workout")
+    args = parser.parse_args()
+
+    w = Workout("bench", workout_content(args.steps))
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    steps = w.compile_steps()
+    parsed = tracemalloc.get_traced_memory()
+    payload = [s.create_step_json() for s in steps]
+    elapsed = time.perf_counter() - start
+    current, peak = tracemalloc.get_traced_memory()
+    blocks = sum(stat.count for stat in tracemalloc.take_snapshot().statistics("filename"))
+    tracemalloc.stop()
+
+    print("steps          %d" % len(steps))
+    print("steps memory   %.1f MiB" % (parsed[0] / 1048576.0))
+    print("total memory   %.1f MiB (peak %.1f MiB)" % (current / 1048576.0, peak / 1048576.0))
+    print("live blocks    %d" % blocks)
+    print("time           %.2f s" % elapsed)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+
+# End to end sync benchmark against the local fake garmin server, no network needed
+#   python tools/bench_sync.py [--events 10000] [--latency 0.0] [--throttle-rate 0.0]
+
+import argparse
+import contextlib
+import io
+import json
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import app
+
+from fakegarmin import FakeGarminServer
+
+def run_sync(url, rate):
+    args = argparse.Namespace(
+        id="bench", name="basic", username=None, password=None, tokenstore=None, cache_dir=None,
+        rate=rate, garmin_url=url, ical_url=url, pool_size=10, timeout=30.0, max_deletes=None, workers=4, journal=None, timings=None, metrics=None, record=None, replay=None, debug=False)
+
+    calls = app._metrics().total_calls()
+    start = time.perf_counter()
+    # The calendar parser prints every event
+    with contextlib.redirect_stdout(io.StringIO()):
+        app.command_sync(args)
+    return time.perf_counter() - start, app._metrics().total_calls() - calls
+
+def main():
+    parser = argparse.ArgumentParser(description="Sync benchmark")
+    parser.add_argument("--events", type=int, default=10000, help="Number of calendar events")
+    parser.add_argument("--latency", type=float, default=0.0, help="Mean added server latency in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with 503")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Fraction of requests answered with 429")
+    parser.add_argument("--rate", type=float, default=100000.0, help="Client request rate limit")
+    parser.add_argument("--runs", type=int, default=2, help="Number of syncs, the later ones find the workouts in place")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    server = FakeGarminServer(("127.0.0.1", 0), args.events, args.latency, args.error_rate, args.throttle_rate)
+    server.start()
+
+    for run in range(args.runs):
+        seconds, calls = run_sync(server.url, args.rate)
+        print("run %d: %d events in %.2f s, %.0f events/s, %d garmin calls" % (run + 1, args.events, seconds, args.events / seconds, calls))
+
+    with server.state.lock:
+        print("server requests " + json.dumps(server.state.requests, indent=2, sort_keys=True))
+    server.shutdown()
+
+if __name__ == "__main__":
+    main()
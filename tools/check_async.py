@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+
+# Runs the AsyncGarmin workout and schedule calls against the local fake garmin server, no network needed
+#   python tools/check_async.py [--workouts 50] [--error-rate 0.3]
+# Fails when a call goes missing, or when a POST is sent again after a server error.
+
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import garth
+
+from garth.auth_tokens import OAuth2Token
+
+from clients.garminasync import AsyncGarmin
+from clients.ratelimit import RetryPolicy, TokenBucket
+from fakegarmin import FakeGarminServer
+
+_CREATE = "POST ^/workout-service/workout$"
+_SCHEDULE = "POST ^/workout-service/schedule/(\\d+)$"
+_LIST = "GET ^/workout-service/workouts$"
+
+def client(url):
+    # The fake server takes any token, one that does not expire keeps garth from refreshing
+    garth_client = garth.Client()
+    expires = int(time.time()) + 3600
+    garth_client.oauth2_token = OAuth2Token(
+        scope="", jti="check", token_type="Bearer", access_token="check", refresh_token="check",
+        expires_in=3600, expires_at=expires, refresh_token_expires_in=3600, refresh_token_expires_at=expires)
+    connection = AsyncGarmin(garth_client, rate_limiter=TokenBucket(rate=100000.0), retry_policy=RetryPolicy(base_delay=0.001))
+    connection.base_url = url
+    return connection
+
+def workout(i):
+    return {"workoutName": "Check %d" % i, "sportType": {"sportTypeId": 1, "sportTypeKey": "running"}, "workoutSegments": []}
+
+async def attempt(call):
+    try:
+        return await call
+    except Exception as err:
+        return err
+
+async def run(url, n):
+    async with client(url) as connection:
+        created = await asyncio.gather(*(attempt(connection.upload_workout(workout(i))) for i in range(n)))
+        ids = [c["workoutId"] for c in created if isinstance(c, dict)]
+        scheduled = await asyncio.gather(*(attempt(connection.schedule_workout(wid, "2026-01-15")) for wid in ids))
+        listed = await attempt(connection.get_workouts(0, n))
+        month = await attempt(connection.get_schedule(2026, 0))
+    return created, ids, scheduled, listed, month
+
+def main():
+    parser = argparse.ArgumentParser(description="AsyncGarmin check")
+    parser.add_argument("--workouts", type=int, default=50, help="Number of workouts to create and schedule")
+    parser.add_argument("--error-rate", type=float, default=0.3, help="Fraction of requests answered with 503 in the second run")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+
+    failures = []
+    for error_rate in (0.0, args.error_rate):
+        server = FakeGarminServer(("127.0.0.1", 0), 0, error_rate=error_rate)
+        server.start()
+        start = time.perf_counter()
+        created, ids, scheduled, listed, month = asyncio.run(run(server.url, args.workouts))
+        seconds = time.perf_counter() - start
+        with server.state.lock:
+            requests = dict(server.state.requests)
+            workouts = len(server.state.workouts)
+        server.shutdown()
+
+        name = "error rate %.2f" % error_rate
+        scheduled_ok = len([s for s in scheduled if not isinstance(s, Exception)])
+        print("%s: %d of %d workouts created, %d scheduled in %.2f s, server requests %s" % (
+            name, len(ids), args.workouts, scheduled_ok, seconds, requests))
+
+        # Every POST reaches the server once, whatever the answer was
+        if requests.get(_CREATE, 0) != args.workouts:
+            failures.append("%s: %d workout POSTs for %d uploads" % (name, requests.get(_CREATE, 0), args.workouts))
+        if requests.get(_SCHEDULE, 0) != len(ids):
+            failures.append("%s: %d schedule POSTs for %d workouts" % (name, requests.get(_SCHEDULE, 0), len(ids)))
+        if workouts != len(ids):
+            failures.append("%s: %d workouts on the server, %d created" % (name, workouts, len(ids)))
+        # Reads are retried till they succeed
+        if isinstance(listed, Exception) or len(listed) != workouts:
+            failures.append("%s: listing failed or incomplete: %s" % (name, listed if isinstance(listed, Exception) else len(listed)))
+        if isinstance(month, Exception) or len(month["calendarItems"]) != scheduled_ok:
+            failures.append("%s: month failed or incomplete: %s" % (name, month if isinstance(month, Exception) else len(month["calendarItems"])))
+        if error_rate == 0.0 and (len(ids) != args.workouts or scheduled_ok != len(ids)):
+            failures.append("%s: calls failed without errors on the server" % name)
+        if error_rate > 0.0 and requests.get(_LIST, 0) < 1:
+            failures.append("%s: workouts were not listed" % name)
+
+    for failure in failures:
+        print("FAIL " + failure)
+    sys.exit(1 if failures else 0)
+
+if __name__ == "__main__":
+    main()
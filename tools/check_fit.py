@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+
+# Round trips the test workouts through the FIT encoder and the fitdecode reader, with the crc checked
+#   python tools/check_fit.py [--workouts test_workouts]
+# Fails when a file does not decode or a step does not come back as the workout model has it.
+
+import argparse
+import io
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import fitdecode
+
+from models.fit import FitWorkoutEncoder
+from models.workout import Workout
+
+_WORKOUTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "test_workouts")
+
+# Field numbers of the workout_step message, the raw values are compared
+_MESSAGE_INDEX = 254
+_DURATION_TYPE = 1
+_DURATION_VALUE = 2
+_TARGET_TYPE = 3
+# repeat_steps on a repeat step
+_TARGET_VALUE = 4
+_TARGET_LOW = 5
+_TARGET_HIGH = 6
+_INTENSITY = 7
+_NOTES = 8
+
+def decode(data):
+    """The data messages of a FIT file as (name, {field number: raw value}), raises on a bad crc or record"""
+    messages = []
+    with fitdecode.FitReader(io.BytesIO(data), check_crc=fitdecode.CrcCheck.RAISE,
+                             error_handling=fitdecode.ErrorHandling.RAISE) as reader:
+        for frame in reader:
+            if isinstance(frame, fitdecode.FitDataMessage):
+                messages.append((frame.name, {f.def_num: f.raw_value for f in frame.fields}))
+    return messages
+
+def expected_steps(steps, rows):
+    """The workout_step raw values in file order: repeated steps first, then the step pointing back to them"""
+    for s in steps:
+        if s.is_repeat():
+            first = len(rows)
+            expected_steps(s.get_repeat_steps(), rows)
+            rows.append({_MESSAGE_INDEX: len(rows), _DURATION_TYPE: FitWorkoutEncoder._DURATION_REPEAT_UNTIL_STEPS_CMPLT,
+                         _DURATION_VALUE: first, _TARGET_VALUE: s.get_repeat_iterations()})
+            continue
+
+        row = {_MESSAGE_INDEX: len(rows), _DURATION_TYPE: FitWorkoutEncoder._DURATION_OPEN, _DURATION_VALUE: None,
+               _TARGET_TYPE: FitWorkoutEncoder._TARGET_OPEN, _TARGET_LOW: None, _TARGET_HIGH: None,
+               _INTENSITY: FitWorkoutEncoder._INTENSITY_ACTIVE}
+        if s.get_end_distance() is not None:
+            row[_DURATION_TYPE], row[_DURATION_VALUE] = FitWorkoutEncoder._DURATION_DISTANCE, int(s.get_end_distance() * 100)
+        elif s.get_end_time() is not None:
+            row[_DURATION_TYPE], row[_DURATION_VALUE] = FitWorkoutEncoder._DURATION_TIME, int(s.get_end_time() * 1000)
+        if s.get_target_bpm() is not None:
+            low, high = s.get_target_bpm()
+            row[_TARGET_TYPE] = FitWorkoutEncoder._TARGET_HEART_RATE
+            row[_TARGET_LOW], row[_TARGET_HIGH] = low + FitWorkoutEncoder._HEART_RATE_OFFSET, high + FitWorkoutEncoder._HEART_RATE_OFFSET
+        elif s.get_target_speed() is not None:
+            fast, slow = s.get_target_speed()
+            row[_TARGET_TYPE] = FitWorkoutEncoder._TARGET_SPEED
+            row[_TARGET_LOW], row[_TARGET_HIGH] = int(round(slow * 1000)), int(round(fast * 1000))
+        if s.is_warmup():
+            row[_INTENSITY] = FitWorkoutEncoder._INTENSITY_WARMUP
+        elif s.is_cooldown():
+            row[_INTENSITY] = FitWorkoutEncoder._INTENSITY_COOLDOWN
+        elif s.is_recovery():
+            row[_INTENSITY] = FitWorkoutEncoder._INTENSITY_RECOVERY
+        row[_NOTES] = s.get_description()
+        rows.append(row)
+    return rows
+
+def check(name, content):
+    """Differences between the workout and its decoded FIT file"""
+    workout = Workout(name, content)
+    messages = decode(FitWorkoutEncoder().encode(workout, name))
+    failures = []
+
+    names = [m[0] for m in messages]
+    if names[:2] != ["file_id", "workout"]:
+        return ["messages %s, expected file_id and workout first" % names[:2]]
+    file_id, header = messages[0][1], messages[1][1]
+    steps = [m[1] for m in messages[2:] if m[0] == "workout_step"]
+    expected = expected_steps(workout.compile_steps(), [])
+
+    if file_id[0] != FitWorkoutEncoder._FILE_TYPE_WORKOUT:
+        failures.append("file type %s" % file_id[0])
+    if header[8] != name[:FitWorkoutEncoder._NAME_SIZE - 1] or header[6] != len(expected):
+        failures.append("workout %r with %s steps, expected %r with %d" % (header[8], header[6], name, len(expected)))
+    if len(steps) != len(expected):
+        failures.append("%d steps decoded, expected %d" % (len(steps), len(expected)))
+
+    for decoded, row in zip(steps, expected):
+        for field, value in row.items():
+            got = decoded.get(field)
+            if field == _NOTES:
+                # Truncated to the notes field, the description itself is only checked to start with it
+                if not (value or "").startswith(got or ""):
+                    failures.append("step %d notes %r, expected %r" % (row[_MESSAGE_INDEX], got, value))
+            elif got != value:
+                failures.append("step %d field %d is %r, expected %r" % (row[_MESSAGE_INDEX], field, got, value))
+    return failures
+
+def main():
+    parser = argparse.ArgumentParser(description="FIT encoder round trip check")
+    parser.add_argument("--workouts", default=_WORKOUTS_DIR, help="Directory with the workout text files")
+    args = parser.parse_args()
+
+    failures = []
+    for filename in sorted(os.listdir(args.workouts)):
+        with open(os.path.join(args.workouts, filename)) as f:
+            content = f.read()
+        name = os.path.splitext(filename)[0]
+        try:
+            problems = check(name, content)
+        except (fitdecode.FitError, ValueError) as err:
+            problems = ["does not decode: %s" % err]
+        print("%-24s %s" % (name, "ok" if not problems else "%d problems" % len(problems)))
+        failures.extend("%s: %s" % (name, p) for p in problems)
+
+    for failure in failures:
+        print("FAIL " + failure)
+    sys.exit(1 if failures else 0)
+
+if __name__ == "__main__":
+    main()
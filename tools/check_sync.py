@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+
+# Replays recorded sync sessions offline and fails when a sync makes other requests than recorded or gets slower
+#   python tools/check_sync.py [--slack 2.0]     replay the fixtures in tools/fixtures
+#   python tools/check_sync.py --record          record them again against tools/fakegarmin.py
+# After a change that is meant to alter the requests, record again and update _SCENARIOS.
+
+import argparse
+import contextlib
+import io
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import app
+
+# Imported before the timed syncs, the budgets are for the sync, tools/bench_import.py watches the imports
+import clients.garminapi
+import clients.replay
+import models.plan
+
+from clients.icalclient import CalendarItem
+from fakegarmin import FakeGarminServer
+
+_FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+_EVENTS = 12
+
+# The replayed requests never reach this host
+_REPLAY_URL = "http://replay.invalid"
+
+# Fixture name, change of the fake calendar before the sync, http requests, garmin calls and the
+# seconds budget of the replayed sync. The scenarios run in order against one fake server.
+_SCENARIOS = (
+    ("sync_new", None, 27, 26, 0.3),
+    ("sync_unchanged", None, 3, 2, 0.1),
+    ("sync_moved", lambda state: state.generate_events(_EVENTS - 3, seed=2), 22, 21, 0.3),
+)
+
+def run_sync(fixture, url, record):
+    args = argparse.Namespace(
+        id="check", name="basic", username=None, password=None, tokenstore=None, cache_dir=None,
+        rate=100000.0, garmin_url=url, ical_url=url, pool_size=10, timeout=30.0, max_deletes=25, workers=4, journal=None,
+        timings=None, metrics=None, record=fixture if record else None, replay=None if record else fixture, debug=False)
+
+    # Every scenario has a cassette and a calendar date of its own
+    app._CASSETTE = None
+    CalendarItem.pinned_today = None
+
+    calls = app._metrics().total_calls()
+    start = time.perf_counter()
+    # The calendar parser prints every event
+    with contextlib.redirect_stdout(io.StringIO()):
+        app.command_sync(args)
+    seconds = time.perf_counter() - start
+
+    cassette = app._CASSETTE
+    cassette.save()
+    requests = len(cassette.interactions) if record else cassette.played
+    return seconds, requests, app._metrics().total_calls() - calls, cassette
+
+def record():
+    server = FakeGarminServer(("127.0.0.1", 0), _EVENTS)
+    server.start()
+    try:
+        for name, change, _, _, _ in _SCENARIOS:
+            if change is not None:
+                change(server.state)
+            seconds, requests, calls, cassette = run_sync(os.path.join(_FIXTURES_DIR, name + ".json"), server.url, True)
+            print("%s: recorded %d http requests, %d garmin calls in %.2f s" % (name, requests, calls, seconds))
+    finally:
+        server.shutdown()
+
+def replay(slack):
+    failures = []
+    for name, _, expected_requests, expected_calls, budget in _SCENARIOS:
+        seconds, requests, calls, cassette = run_sync(os.path.join(_FIXTURES_DIR, name + ".json"), _REPLAY_URL, False)
+        print("%s: %d http requests, %d garmin calls in %.3f s (budget %.3f s)" % (name, requests, calls, seconds, budget * slack))
+
+        if cassette.misses:
+            failures.append("%s: requests that were not recorded %s" % (name, cassette.misses))
+        if cassette.unplayed():
+            failures.append("%s: recorded requests that were not made %s" % (name, cassette.unplayed()))
+        if requests != expected_requests:
+            failures.append("%s: %d http requests, expected %d" % (name, requests, expected_requests))
+        if calls != expected_calls:
+            failures.append("%s: %d garmin calls, expected %d" % (name, calls, expected_calls))
+        if seconds > budget * slack:
+            failures.append("%s: took %.3f s, the budget is %.3f s" % (name, seconds, budget * slack))
+    return failures
+
+def main():
+    parser = argparse.ArgumentParser(description="Sync request and time check on recorded sessions")
+    parser.add_argument("--record", action="store_true", help="Record the fixtures again against the fake garmin server")
+    parser.add_argument("--slack", type=float, default=1.0, help="Multiplier of the time budgets, for slow machines")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    if args.record:
+        record()
+        return
+
+    failures = replay(args.slack)
+    for failure in failures:
+        print("FAIL " + failure)
+    sys.exit(1 if failures else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,346 @@
+#!/usr/bin/env python3
+
+# Local stand-in for the Garmin Connect workout and calendar services and the google calendar ics feed
+#   python tools/fakegarmin.py --port 8400 --events 200 --latency 0.05 --throttle-rate 0.01
+#   python app.py --garmin-url http://127.0.0.1:8400 --ical-url http://127.0.0.1:8400 sync --id fake --name basic
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+
+from datetime import date, datetime, timedelta, timezone
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+_WORKOUTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "test_workouts")
+
+class FakeGarminState(object):
+    """In memory workouts, schedules and calendar events"""
+
+    def __init__(self, events=100, seed=1):
+        self.lock = threading.Lock()
+        self.workouts = {}
+        self.schedules = {}
+        self.next_id = 1000
+        self.requests = {}
+        self.uploads = {}
+        self.events = []
+        self.ics_version = 0
+        self.generate_events(events, seed)
+
+    def generate_events(self, n, seed=1):
+        # Events spread over the window the sync looks at, two days back till a week ahead
+        rnd = random.Random(seed)
+        contents = []
+        for name in sorted(os.listdir(_WORKOUTS_DIR)):
+            with open(os.path.join(_WORKOUTS_DIR, name)) as f:
+                contents.append(f.read().strip())
+
+        today = date.today()
+        with self.lock:
+            self.events = []
+            for i in range(n):
+                self.events.append({
+                    "uid": "fake-event-%d@fakegarmin" % i,
+                    "title": "Run %d" % i,
+                    "description": contents[i % len(contents)],
+                    "date": today + timedelta(days=rnd.randint(-2, 7)),
+                })
+            self.ics_version = self.ics_version + 1
+            self.modified = datetime.utcnow() - timedelta(days=1)
+
+    def ics(self):
+        lines = ["BEGIN:VCALENDAR", "VERSION:2.0"]
+        with self.lock:
+            modified = self.modified.strftime("%Y%m%dT%H%M%SZ")
+            for e in self.events:
+                lines.extend([
+                    "BEGIN:VEVENT",
+                    "DTSTART;VALUE=DATE:%s" % e["date"].strftime("%Y%m%d"),
+                    "UID:%s" % e["uid"],
+                    "SUMMARY:%s" % e["title"],
+                    "DESCRIPTION:%s" % e["description"].replace("\n", "\\n"),
+                    "LAST-MODIFIED:%s" % modified,
+                    "END:VEVENT",
+                ])
+        lines.append("END:VCALENDAR")
+        return "\r\n".join(lines) + "\r\n"
+
+    def new_id(self):
+        self.next_id = self.next_id + 1
+        return self.next_id
+
+    def count(self, method, template):
+        key = "%s %s" % (method, template)
+        with self.lock:
+            self.requests[key] = self.requests.get(key, 0) + 1
+
+class FakeGarminHandler(BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately, without this every keep-alive response waits for a delayed ack
+    disable_nagle_algorithm = True
+
+    _ROUTES = [
+        ("GET", re.compile(r"^/workout-service/workouts$"), "list_workouts"),
+        ("GET", re.compile(r"^/workout-service/workout/(\d+)$"), "get_workout"),
+        ("POST", re.compile(r"^/workout-service/workout$"), "create_workout"),
+        ("PUT", re.compile(r"^/workout-service/workout/(\d+)$"), "update_workout"),
+        ("DELETE", re.compile(r"^/workout-service/workout/(\d+)$"), "delete_workout"),
+        ("POST", re.compile(r"^/workout-service/schedule/(\d+)$"), "create_schedule"),
+        ("DELETE", re.compile(r"^/workout-service/schedule/(\d+)$"), "delete_schedule"),
+        ("POST", re.compile(r"^/upload-service/upload$"), "upload_activity"),
+        ("GET", re.compile(r"^/calendar-service/year/(\d+)/month/(\d+)$"), "get_month"),
+        ("GET", re.compile(r"^/calendar/ical/([^/]+)/([^/]+)/basic\.ics$"), "get_ics"),
+        ("GET", re.compile(r"^/_stats$"), "get_stats"),
+        ("POST", re.compile(r"^/_reset$"), "reset"),
+    ]
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def do_PUT(self):
+        self._dispatch("PUT")
+
+    def do_DELETE(self):
+        self._dispatch("DELETE")
+
+    def log_message(self, format, *args):
+        logging.debug(format % args)
+
+    def _dispatch(self, method):
+        url = urlparse(self.path)
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length) if length else b""
+
+        for route_method, regex, name in FakeGarminHandler._ROUTES:
+            match = regex.match(url.path)
+            if route_method == method and match:
+                break
+        else:
+            self._send(404, {"message": "Not found"})
+            return
+
+        server = self.server
+        if not url.path.startswith("/_"):
+            server.state.count(method, regex.pattern)
+            if server.latency:
+                time.sleep(random.expovariate(1.0 / server.latency))
+            if random.random() < server.throttle_rate:
+                self._send(429, {"message": "Too many requests"}, {"Retry-After": "1"})
+                return
+            if random.random() < server.error_rate:
+                self._send(503, {"message": "Service unavailable"})
+                return
+
+        query = { k: v[0] for k, v in parse_qs(url.query).items() }
+        if body and self.headers.get("Content-Type", "").startswith("application/json"):
+            body = json.loads(body)
+        getattr(self, "_" + name)(query, body or None, *match.groups())
+
+    def _send(self, status, payload=None, headers=None, content_type="application/json"):
+        if payload is None:
+            data = b""
+        elif isinstance(payload, str):
+            data = payload.encode("utf-8")
+        else:
+            data = json.dumps(payload).encode("utf-8")
+
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _list_workouts(self, query, body):
+        start = int(query.get("start", 0))
+        limit = int(query.get("limit", 100))
+        state = self.server.state
+        with state.lock:
+            items = sorted(state.workouts.values(), key=lambda w: w["workoutId"])[start:start + limit]
+            summaries = [{ k: w.get(k) for k in ("workoutId", "workoutName", "description", "ownerId", "updatedDate") } for w in items]
+        self._send(200, summaries)
+
+    def _get_workout(self, query, body, workout_id):
+        state = self.server.state
+        with state.lock:
+            workout = state.workouts.get(int(workout_id))
+        if workout is None:
+            self._send(404, {"message": "Workout not found"})
+        else:
+            self._send(200, workout)
+
+    def _create_workout(self, query, body):
+        state = self.server.state
+        with state.lock:
+            workout = dict(body)
+            workout["workoutId"] = state.new_id()
+            workout["ownerId"] = 1
+            workout["updatedDate"] = datetime.utcnow().isoformat()
+            state.workouts[workout["workoutId"]] = workout
+        self._send(200, workout)
+
+    def _update_workout(self, query, body, workout_id):
+        state = self.server.state
+        with state.lock:
+            if int(workout_id) not in state.workouts:
+                self._send(404, {"message": "Workout not found"})
+                return
+            workout = dict(body)
+            workout["workoutId"] = int(workout_id)
+            workout["ownerId"] = 1
+            workout["updatedDate"] = datetime.utcnow().isoformat()
+            state.workouts[int(workout_id)] = workout
+            for s in state.schedules.values():
+                if s["workoutId"] == int(workout_id):
+                    s["title"] = workout.get("workoutName")
+        self._send(204)
+
+    def _delete_workout(self, query, body, workout_id):
+        state = self.server.state
+        with state.lock:
+            if state.workouts.pop(int(workout_id), None) is None:
+                self._send(404, {"message": "Workout not found"})
+                return
+            # Deleting a workout also removes it from the calendar
+            for sid in [sid for sid, s in state.schedules.items() if s["workoutId"] == int(workout_id)]:
+                del state.schedules[sid]
+        self._send(204)
+
+    def _create_schedule(self, query, body, workout_id):
+        state = self.server.state
+        with state.lock:
+            workout = state.workouts.get(int(workout_id))
+            if workout is None:
+                self._send(404, {"message": "Workout not found"})
+                return
+            schedule = {
+                "id": state.new_id(),
+                "itemType": "workout",
+                "workoutId": int(workout_id),
+                "title": workout.get("workoutName"),
+                "date": body["date"],
+            }
+            state.schedules[schedule["id"]] = schedule
+        self._send(200, {"workoutScheduleId": schedule["id"], "workout": workout, "calendarDate": body["date"]})
+
+    def _delete_schedule(self, query, body, schedule_id):
+        state = self.server.state
+        with state.lock:
+            if state.schedules.pop(int(schedule_id), None) is None:
+                self._send(404, {"message": "Schedule not found"})
+                return
+        self._send(204)
+
+    def _upload_activity(self, query, body):
+        # Only the content of the multipart file part matters, duplicates are recognized by their hash
+        boundary = self.headers.get("Content-Type", "").split("boundary=")[-1].encode("ascii")
+        content = body.split(b"\r\n\r\n", 1)[-1].rsplit(b"\r\n--" + boundary, 1)[0]
+        digest = hashlib.sha1(content).hexdigest()
+        state = self.server.state
+        with state.lock:
+            duplicate = digest in state.uploads
+            if not duplicate:
+                state.uploads[digest] = state.new_id()
+            activity_id = state.uploads[digest]
+
+        if duplicate:
+            failure = {"internalId": activity_id, "messages": [{"code": 202, "content": "Duplicate Activity."}]}
+            self._send(409, {"detailedImportResult": {"successes": [], "failures": [failure]}})
+        else:
+            self._send(201, {"detailedImportResult": {"successes": [{"internalId": activity_id}], "failures": []}})
+
+    def _get_month(self, query, body, year, month):
+        # Like garmin the month is zero based
+        prefix = "%04d-%02d" % (int(year), int(month) + 1)
+        state = self.server.state
+        with state.lock:
+            items = [dict(s) for s in state.schedules.values() if s["date"].startswith(prefix)]
+        self._send(200, {"startDate": prefix + "-01", "calendarItems": items})
+
+    def _get_ics(self, query, body, calendar, name):
+        state = self.server.state
+        data = state.ics()
+        etag = '"%s"' % hashlib.sha1(data.encode("utf-8")).hexdigest()
+        headers = {"ETag": etag, "Last-Modified": formatdate(state.modified.replace(tzinfo=timezone.utc).timestamp(), usegmt=True)}
+        if self.headers.get("If-None-Match") == etag:
+            self._send(304, None, headers)
+            return
+        self._send(200, data, headers, "text/calendar")
+
+    def _get_stats(self, query, body):
+        state = self.server.state
+        with state.lock:
+            stats = {
+                "requests": dict(state.requests),
+                "workouts": len(state.workouts),
+                "schedules": len(state.schedules),
+                "uploads": len(state.uploads),
+                "events": len(state.events),
+            }
+        self._send(200, stats)
+
+    def _reset(self, query, body):
+        state = self.server.state
+        with state.lock:
+            state.workouts.clear()
+            state.schedules.clear()
+            state.uploads.clear()
+            state.requests.clear()
+        self._send(204)
+
+class FakeGarminServer(ThreadingHTTPServer):
+
+    daemon_threads = True
+
+    def __init__(self, address, events=100, latency=0.0, error_rate=0.0, throttle_rate=0.0):
+        ThreadingHTTPServer.__init__(self, address, FakeGarminHandler)
+        self.state = FakeGarminState(events)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+
+    @property
+    def url(self):
+        return "http://%s:%d" % self.server_address[:2]
+
+    def start(self):
+        """Serve on a background thread, for benchmarks running in the same process"""
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+def main():
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter, description="Fake Garmin Connect server")
+    parser.add_argument("--host", default="127.0.0.1", help="Listen address")
+    parser.add_argument("--port", type=int, default=8400, help="Listen port")
+    parser.add_argument("--events", type=int, default=100, help="Number of events in the ics feed")
+    parser.add_argument("--latency", type=float, default=0.0, help="Mean added latency in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with 503")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Fraction of requests answered with 429")
+    parser.add_argument("--debug", action="store_true", help="Log every request")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.INFO)
+
+    server = FakeGarminServer((args.host, args.port), args.events, args.latency, args.error_rate, args.throttle_rate)
+    logging.info("Fake garmin listening on %s with %d events" % (server.url, args.events))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()